@@ -1,8 +1,11 @@
 import json
 import os
+import asyncio
 import datetime
 from typing import Dict, Any, List, Optional
 
+from metrics import traced
+
 ACHIEVEMENTS_DEFINITION_FILE = os.path.join(os.path.dirname(__file__), "achievements_data.json")
 USER_DATA_DIR = os.path.join(os.path.dirname(__file__), "user_data")
 
@@ -48,9 +51,11 @@ class AchievementManager:
         except IOError as e:
             print(f"❌ Error al guardar datos para el usuario {user_id}: {e}")
 
+    @traced("achievements_get")
     async def get_user_achievements(self, user_id: str) -> List[Dict[str, Any]]:
         """Obtiene una lista de los logros desbloqueados por un usuario."""
-        user_data = self._get_user_data(user_id)
+        # La lectura del archivo se hace en un hilo para no bloquear el event loop
+        user_data = await asyncio.to_thread(self._get_user_data, user_id)
         unlocked_ids = user_data.get("achievements", {})
         
         result = []
@@ -65,6 +70,7 @@ class AchievementManager:
                 })
         return result
 
+    @traced("achievements_check")
     async def check_and_unlock_quiz_achievements(self, user_id: str, subtopic: str, score: float) -> Optional[Dict[str, Any]]:
         """
         Verifica si los resultados de un quiz desbloquean algún logro.
@@ -3,20 +3,52 @@
 API principal de FastAPI para la asistente Eleonor AI.
 Handles chat streaming, text-to-speech, and VTube Studio integration.
 '''
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import asyncio
+import base64
 import json
-import re
+import os
+import time
+from typing import AsyncIterator
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import custom modules
 import openai_integration
+import openai_client
 import text_to_speech # Volvemos al nombre original del módulo
+import audio_playback
+import expression_classifier
+import metrics
+import vector_store
+import single_flight
 from vtube_client import vts_client # Import the unified async client instance
 from semantic_memory import SemanticMemory
 from achievement_manager import AchievementManager
+from context_assembly import ContextAssembler
+from prompt_builder import prompt_builder
+from conversation_buffer import conversation_buffer
+from sentence_stream import SentenceSplitter, ExpressionTagParser
+from tts_pipeline import TTSPipeline, StreamingTTSPipeline
+from tts_cache import tts_cache
+from response_cache import (RESPONSE_CACHE_ENABLED, ResponseCache, TurnRecorder, persona_key,
+                            replay_stream, replay_synthesize, response_cache)
+from ws_protocol import ChatConnection
+
+# --- Context Timeouts (seconds) ---
+# A context source slower than its timeout is dropped instead of delaying the answer.
+MEMORY_CONTEXT_TIMEOUT = float(os.getenv("MEMORY_CONTEXT_TIMEOUT", "1.5"))
+ACHIEVEMENTS_CONTEXT_TIMEOUT = float(os.getenv("ACHIEVEMENTS_CONTEXT_TIMEOUT", "0.5"))
+RECENT_TURNS_CONTEXT_TIMEOUT = float(os.getenv("RECENT_TURNS_CONTEXT_TIMEOUT", "0.2"))
+# Memories retrieved per turn; the prompt builder keeps as many as fit its token budget
+MEMORY_CONTEXT_RESULTS = int(os.getenv("MEMORY_CONTEXT_RESULTS", "3"))
+
+# Maximum number of events buffered between a running turn and its transport
+TURN_EVENT_QUEUE_SIZE = int(os.getenv("TURN_EVENT_QUEUE_SIZE", "64"))
+
+# Cached answers are only reused under the same system prompt
+PERSONA_KEY = persona_key(openai_integration.SYSTEM_PROMPT_CON_EXPRESIONES)
 
 # --- Global State for Audio Device ---
 # This will hold the currently selected audio device ID for TTS playback.
@@ -26,9 +58,21 @@ current_audio_device_id = None
 class ChatRequest(BaseModel):
     text: str
     user_id: str | None = None
+    # If true, audio is sent as 'audio_chunk' events while edge-tts produces it,
+    # instead of one 'audio' event per finished sentence.
+    stream_audio: bool = False
+    # If true (or if a trace_id is given), the turn's stages are traced and the trace ID
+    # is returned in the 'done' event; see GET /api/traces/{trace_id}.
+    trace: bool = False
+    trace_id: str | None = None
 
 class MemoryRequest(BaseModel):
     text: str
+    user_id: str | None = None
+
+class BulkMemoryRequest(BaseModel):
+    texts: list[str]
+    user_id: str | None = None
 
 class QuizResultRequest(BaseModel):
     user_id: str
@@ -57,80 +101,304 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Context Providers ---
+async def memory_context(prompt: str, user_id: str | None) -> str | None:
+    """Most relevant past memories for the prompt, one per line, best first."""
+    print(f"🧠 Buscando recuerdos relevantes para: '{prompt}'")
+    retrieved_memories = await memory.retrieve_memories(query_text=prompt, n_results=MEMORY_CONTEXT_RESULTS, user_id=user_id)
+    if retrieved_memories and retrieved_memories.get('documents') and retrieved_memories['documents'][0]:
+        documents = [" ".join(document.split()) for document in retrieved_memories['documents'][0]]
+        print(f"Contexto recuperado de la memoria: {len(documents)} recuerdo(s), el principal: '{documents[0]}'")
+        return "\n".join(f'- "{document}"' for document in documents)
+    print("No se encontraron recuerdos relevantes.")
+    return None
+
+async def recent_turns_context(prompt: str, user_id: str | None) -> str | None:
+    """The user's last turns, from the in-memory conversation buffer."""
+    if not user_id:
+        return None
+    return conversation_buffer.context(user_id)
+
+async def achievements_context(prompt: str, user_id: str | None) -> str | None:
+    """List of the achievements the user has already unlocked."""
+    if not user_id:
+        return None
+    user_achievements = await achievement_manager.get_user_achievements(user_id)
+    if not user_achievements:
+        return None
+    return "\n".join([f'- {a["name"]}' for a in user_achievements])
+
+context_assembler = ContextAssembler()
+context_assembler.register("recent_turns", recent_turns_context, RECENT_TURNS_CONTEXT_TIMEOUT)
+context_assembler.register("memory", memory_context, MEMORY_CONTEXT_TIMEOUT)
+context_assembler.register("achievements", achievements_context, ACHIEVEMENTS_CONTEXT_TIMEOUT)
+
 # --- Main Streaming Logic ---
-async def stream_generator(prompt: str, user_id: str | None):
+async def trigger_expression_task(full_response: str, recorder: TurnRecorder | None = None):
+    """Decides and triggers the expression based on the full response."""
+    with metrics.timed("expression_select"):
+        expression_name = await expression_classifier.select_expression(full_response)
+    if recorder:
+        recorder.set_expression(expression_name)
+    if expression_name:
+        print(f"✨ Expresión elegida: {expression_name}")
+        await vts_client.activate_expression(expression_name)
+    else:
+        print("😐 Tono neutral, no se activó ninguna expresión.")
+
+async def activate_expression_on_playback(handle, expression_name: str):
+    """Activates an expression when the sentence it belongs to starts playing."""
+    while not handle.started and not handle.done():
+        await asyncio.sleep(0.02)
+    print(f"✨ Expresión marcada en la respuesta: {expression_name}")
+    await vts_client.activate_expression(expression_name)
+
+async def forward_audio(pipeline: TTSPipeline, events: asyncio.Queue):
     """
-    Genera un stream de texto y audio, manejando expresiones de VTube Studio
-    y utilizando la memoria semántica para dar contexto a la IA.
+    Plays the synthesized sentences in order and queues their audio events.
+    Audio events carry the raw MP3 in 'data'; each transport encodes it its own way.
     """
-    try:
-        if not memory:
-            raise RuntimeError("La memoria semántica no está inicializada.")
-        if not achievement_manager:
-            raise RuntimeError("El gestor de logros no está inicializado.")
-
-        # 1. Search for relevant memories
-        print(f"🧠 Buscando recuerdos relevantes para: '{prompt}'")
-        retrieved_memories = await memory.retrieve_memories(query_text=prompt, n_results=1)
-        
-        augmented_prompt = prompt
-        if retrieved_memories and retrieved_memories.get('documents') and retrieved_memories['documents'][0]:
-            # Extract the most relevant document
-            context = retrieved_memories['documents'][0][0]
-            print(f"Contexto recuperado de la memoria: '{context}'")
-            
-            # Augment the prompt
-            augmented_prompt = f'''
-            El usuario ha preguntado: "{prompt}"
- 
-            Contexto de una conversación pasada que podría ser relevante:
-            "{context}"
-            '''
-        else:
-            print("No se encontraron recuerdos relevantes.")
-
-        # 2. Get user achievements to provide more context
-        achievements_context = ""
-        if user_id:
-            user_achievements = await achievement_manager.get_user_achievements(user_id)
-            if user_achievements:
-                unlocked_list = "\n".join([f'- {a["name"]}' for a in user_achievements])
-                achievements_context = f"\n\nLogros que el usuario ya ha desbloqueado:\n{unlocked_list}"
+    sentence_index = 0
+    async for _sentence, clip, expression in pipeline.results():
+        if expression:
+            await events.put({'type': 'expression', 'content': expression})
+        if clip:
+            handle = await text_to_speech.play_for_lipsync(clip, device_id=current_audio_device_id)
+            if expression:
+                asyncio.create_task(activate_expression_on_playback(handle, expression))
+            await events.put({'type': 'audio', 'sentence': sentence_index, 'data': clip.mp3_bytes})
+        elif expression:
+            asyncio.create_task(vts_client.activate_expression(expression))
+        sentence_index += 1
+
+async def forward_audio_chunks(pipeline: StreamingTTSPipeline, events: asyncio.Queue):
+    """
+    Progressive variant of forward_audio: forwards each sentence's MP3 chunks as
+    'audio_chunk' events and plays them locally while edge-tts is still producing them.
+    """
+    sentence_index = 0
+    async for _sentence, chunks, expression in pipeline.results():
+        if expression:
+            await events.put({'type': 'expression', 'content': expression})
+        # Without local playback the chunks are still forwarded to the client
+        player = text_to_speech.start_progressive_player(current_audio_device_id)
+        try:
+            async for chunk in chunks:
+                if player:
+                    try:
+                        await player.feed(chunk)
+                    except OSError as e:
+                        print(f"⚠️ La reproducción progresiva se detuvo: {e}")
+                        player.abort()
+                        player = None
+                await events.put({'type': 'audio_chunk', 'sentence': sentence_index, 'data': chunk, 'final': False})
+            if player:
+                await player.finish()
+        except BaseException:
+            if player:
+                player.abort()
+            raise
+        if expression:
+            if player and player.first_handle:
+                asyncio.create_task(activate_expression_on_playback(player.first_handle, expression))
+            else:
+                asyncio.create_task(vts_client.activate_expression(expression))
+        await events.put({'type': 'audio_chunk', 'sentence': sentence_index, 'data': b'', 'final': True})
+        sentence_index += 1
 
-        augmented_prompt = f'''{augmented_prompt}{achievements_context}
+async def run_chat_turn(deltas: AsyncIterator[str], pipeline: TTSPipeline, events: asyncio.Queue,
+                        forward=forward_audio, recorder: TurnRecorder | None = None):
+    """
+    Streams the response (the OpenAI stream, or a cached answer) into `events` as text
+    deltas and submits each complete sentence to the TTS pipeline. Puts None on the queue when finished.
+    Inline [EXPRESION:name] markers are stripped from the text and attached to the
+    sentence where they appear, so the face changes when that sentence is spoken.
+    """
+    audio_task = asyncio.create_task(forward(pipeline, events))
+    cancelled = False
+    try:
+        splitter = SentenceSplitter()
+        tag_parser = ExpressionTagParser(openai_integration.EXPRESIONES_EN_LINEA)
+        response_parts = []
+        pending_expression = None
+        used_inline_tags = False
+
+        async def consume(items):
+            nonlocal pending_expression, used_inline_tags
+            for kind, value in items:
+                if kind == "expression":
+                    pending_expression = value
+                    used_inline_tags = True
+                    continue
+                response_parts.append(value)
+                await events.put({'type': 'text', 'content': value})
+                for sentence in splitter.feed(value):
+                    pipeline.submit(sentence, pending_expression)
+                    pending_expression = None
+
+        # Only the time spent waiting on the stream counts as chat_completion: events.put
+        # blocks while the client reads slowly, and that backpressure is not model latency
+        completion_start = time.perf_counter()
+        consuming = 0.0
+        try:
+            async for delta in deltas:
+                consume_start = time.perf_counter()
+                await consume(tag_parser.feed(delta))
+                consuming += time.perf_counter() - consume_start
+        except openai_integration.StreamInterrupted:
+            # The partial answer is still spoken; the recorder sees it as incomplete
+            print("⚠️ La respuesta se cortó a mitad; se usa el texto recibido.")
+        metrics.record("chat_completion", completion_start, excluded=consuming)
+        tail = tag_parser.flush()
+        if tail:
+            await consume([("text", tail)])
+
+        # Speak whatever is left after the last sentence boundary
+        last_sentence = splitter.flush()
+        if last_sentence:
+            pipeline.submit(last_sentence, pending_expression)
+        elif pending_expression:
+            asyncio.create_task(vts_client.activate_expression(pending_expression))
+        pipeline.close()
+
+        # Without inline markers, fall back to choosing one expression for the whole answer
+        if not used_inline_tags:
+            full_response = "".join(response_parts).strip()
+            if recorder:
+                recorder.expect_expression()
+            asyncio.create_task(trigger_expression_task(full_response, recorder))
+
+        await audio_task
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        if not audio_task.done():
+            pipeline.cancel()
+            audio_task.cancel()
+        # The queue is bounded; if the consumer cancelled us, nobody waits for the end marker
+        if not cancelled:
+            await events.put(None)
+
+async def chat_turn_events(prompt: str, user_id: str | None, stream_audio: bool = False) -> AsyncIterator[dict]:
+    """
+    Runs one chat turn and yields its events (text, expression, audio...) as dicts,
+    independently of the transport (SSE or WebSocket). Errors are raised to the caller.
+    """
+    if not memory:
+        raise RuntimeError("La memoria semántica no está inicializada.")
+    if not achievement_manager:
+        raise RuntimeError("El gestor de logros no está inicializado.")
+    turn_started = time.perf_counter()
+
+    # 1. A near-identical question answered before is replayed from the response cache.
+    #    Not in the middle of a conversation: a follow-up only makes sense with its history.
+    query_vector = cached_turn = None
+    in_conversation = bool(user_id and conversation_buffer.recent(user_id))
+    if RESPONSE_CACHE_ENABLED and not in_conversation:
+        with metrics.timed("chat_cache_lookup"):
+            try:
+                # Same budget as the memory context; a slow embedding counts as a miss
+                query_vector = await asyncio.wait_for(memory.embed(prompt), timeout=MEMORY_CONTEXT_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"⏱️ Caché de respuestas omitida: el embedding superó {MEMORY_CONTEXT_TIMEOUT:.2f} s.")
+            if query_vector is not None:
+                cached_turn = response_cache.lookup(ResponseCache.scopes(PERSONA_KEY, user_id), query_vector)
+
+    recorder = None
+    sections = {}
+    if cached_turn:
+        deltas = cached_turn.deltas()
+        synthesize = replay_synthesize(cached_turn, text_to_speech.decode_speech, text_to_speech.synthesize_speech)
+        stream = replay_stream(cached_turn, text_to_speech.stream_speech)
+    else:
+        # 2. Gather context (memories, achievements, ...) concurrently; slow sources are dropped
+        with metrics.timed("chat_context"):
+            sections = await context_assembler.assemble(prompt, user_id)
+
+        # 3. Fit the question and the available context into the token budget
+        with metrics.timed("chat_prompt_build"):
+            augmented_prompt = prompt_builder.build(prompt, sections)
+        deltas = openai_integration.consulta_openai_stream(
+            augmented_prompt, openai_integration.SYSTEM_PROMPT_CON_EXPRESIONES, route_text=prompt)
+        synthesize, stream = text_to_speech.synthesize_speech, text_to_speech.stream_speech
+        if query_vector is not None:
+            # Record the turn (text, expression, audio) so it can be cached once it finishes
+            recorder = TurnRecorder()
+            deltas = recorder.record_deltas(deltas)
+            synthesize = recorder.record_synthesize(synthesize)
+            stream = recorder.record_stream(stream)
+
+    # 4. Run the turn in the background: the LLM stream emits text events and feeds
+    #    complete sentences to the TTS pipeline, which synthesizes them ahead of playback.
+    # Bounded, so a slow client (see the WebSocket transport) holds back the pipeline
+    events: asyncio.Queue = asyncio.Queue(maxsize=TURN_EVENT_QUEUE_SIZE)
+    if stream_audio:
+        pipeline = StreamingTTSPipeline(stream)
+        forward = forward_audio_chunks
+    else:
+        pipeline = TTSPipeline(synthesize)
+        forward = forward_audio
+    turn_task = asyncio.create_task(run_chat_turn(deltas, pipeline, events, forward, recorder))
+    reply_parts = []
+    first_audio = True
+    try:
+        while (event := await events.get()) is not None:
+            if event['type'] == 'text':
+                if not reply_parts:
+                    metrics.record("chat_first_text", turn_started)
+                reply_parts.append(event['content'])
+            elif event['type'] in ('audio', 'audio_chunk') and event['data'] and first_audio:
+                metrics.record("chat_first_audio", turn_started)
+                first_audio = False
+            yield event
+        await turn_task # Surface any error raised during the turn
+        metrics.record("chat_turn", turn_started)
 
-            Considerando este contexto, responde a la pregunta del usuario.
-        '''
+        if user_id:
+            # Older turns leave the buffer and are folded into long-term memory in the background
+            conversation_buffer.add_turn(user_id, prompt, "".join(reply_parts))
 
-        # 3. Get the full response from OpenAI using the (potentially augmented) prompt
-        full_response = await openai_integration.consulta_openai(augmented_prompt)
+        if recorder and recorder.complete:
+            # Answers built on the user's own context are only reused for that user
+            scope = ResponseCache.scope(PERSONA_KEY, user_id if sections else None)
+            asyncio.create_task(cache_turn(recorder, scope, query_vector))
+    finally:
+        pipeline.cancel()
+        if not turn_task.done():
+            turn_task.cancel()
 
-        # 4. Concurrently, decide and trigger the expression based on the full response
-        async def trigger_expression_task():
-            expression_name = await openai_integration.elegir_expresion(full_response)
-            if expression_name:
-                print(f"✨ Expresión elegida por IA: {expression_name}")
-                await vts_client.activate_expression(expression_name)
-            else:
-                print("😐 Tono neutral, no se activó ninguna expresión.")
-        
-        asyncio.create_task(trigger_expression_task())
-
-        # 5. Split the clean response into sentences for streaming
-        # This regex splits by '.', '!', '?' but keeps the delimiter
-        sentences = re.split(r'(?<=[.!?])\s*', full_response)
-
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
- 
-            # 6. Send the text part (already cleaned)
-            yield f"data: {json.dumps({'type': 'text', 'content': sentence})}\n\n"
-                
-            # 7. Generate and send the audio part
-            audio_base64 = await text_to_speech.get_speech_and_play_for_lipsync(sentence, device_id=current_audio_device_id)
-            if audio_base64:
-                yield f"data: {json.dumps({'type': 'audio', 'content': audio_base64})}\n\n"
+async def cache_turn(recorder: TurnRecorder, scope: str, query_vector):
+    """
+    Stores a finished turn in the response cache once its overall expression is known
+    (it is chosen in a separate task), so replays get the same face. Runs in the background.
+    """
+    if not await recorder.wait_expression():
+        print("⏱️ Turno no guardado en la caché: la expresión no llegó a tiempo.")
+        return
+    turn = recorder.to_turn()
+    if turn.raw_text.strip() != openai_integration.FALLBACK_RESPONSE:
+        response_cache.store(scope, query_vector, turn)
+
+def to_sse(event: dict) -> str:
+    """Serializes an event as an SSE frame; raw audio goes out as Base64 in 'content'."""
+    if 'data' in event:
+        event = dict(event)
+        event['content'] = base64.b64encode(event.pop('data')).decode('utf-8')
+    return f"data: {json.dumps(event)}\n\n"
+
+async def stream_generator(prompt: str, user_id: str | None, stream_audio: bool = False,
+                           trace: bool = False, trace_id: str | None = None):
+    """
+    Genera un stream de texto y audio, manejando expresiones de VTube Studio
+    y utilizando la memoria semántica para dar contexto a la IA.
+    Con stream_audio=True el audio se envía en fragmentos ('audio_chunk') a medida que se genera.
+    Con trace=True (o un trace_id) las etapas del turno se trazan y el evento 'done' lleva su ID.
+    """
+    turn_trace = metrics.start_trace(trace_id) if trace or trace_id else None
+    try:
+        async for event in chat_turn_events(prompt, user_id, stream_audio):
+            yield to_sse(event)
 
     except Exception as e:
         print(f"❌ Error en stream_generator: {e}")
@@ -138,7 +406,26 @@ async def stream_generator(prompt: str, user_id: str | None):
         error_message = json.dumps({'type': 'error', 'content': error_details})
         yield f"data: {error_message}\n\n"
     finally:
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        done = {'type': 'done'}
+        if turn_trace:
+            turn_trace.log()
+            done['trace_id'] = turn_trace.trace_id
+        yield f"data: {json.dumps(done)}\n\n"
+
+async def run_ws_turn(connection: ChatConnection, turn: int, message: dict):
+    """Runs a chat turn requested over the WebSocket and sends its events."""
+    await connection.send_json({'type': 'turn_start', 'turn': turn})
+    try:
+        async for event in chat_turn_events(message.get("text", ""), message.get("user_id"), bool(message.get("stream_audio"))):
+            await connection.send_event(turn, event)
+    except asyncio.CancelledError:
+        # The client may already be gone, so never block here
+        connection.try_send_json({'type': 'cancelled', 'turn': turn})
+        raise
+    except Exception as e:
+        print(f"❌ Error en el turno {turn} del WebSocket: {e}")
+        await connection.send_json({'type': 'error', 'turn': turn, 'content': f"Error en el servidor: {type(e).__name__} - {e}"})
+    await connection.send_json({'type': 'done', 'turn': turn})
 
 # --- API Endpoints ---
 
@@ -146,6 +433,9 @@ async def stream_generator(prompt: str, user_id: str | None):
 async def startup_event():
     """Conecta con VTube Studio y establece el dispositivo de audio por defecto al iniciar."""
     global current_audio_device_id, memory, achievement_manager
+    # Measure how long the event loop stays blocked
+    metrics.event_loop_lag_monitor.start()
+
     # Initialize Semantic Memory
     memory = SemanticMemory()
     print("🧠 Memoria Semántica inicializada.")
@@ -154,6 +444,9 @@ async def startup_event():
     achievement_manager = AchievementManager()
     print("🏆 Gestor de Logros inicializado.")
 
+    # Turns leaving the conversation buffer go to the user's semantic memory
+    conversation_buffer.start(memory.add_memories)
+
     # Connect to VTube Studio
     await vts_client.connect()
 
@@ -165,29 +458,149 @@ async def startup_event():
 async def shutdown_event():
     """Cierra las conexiones al apagar la aplicación."""
     await vts_client.close()
+    audio_playback.close_all_engines()
+    metrics.event_loop_lag_monitor.stop()
+    # Before the vector store executor goes away: pending turns are still written to memory
+    await conversation_buffer.stop()
+    vector_store.close_executor()
+
 @app.post("/api/chat/stream")
 async def handle_chat_stream(request: ChatRequest):
     """
     Processes the chat using streaming of text and audio.
     """
-    return StreamingResponse(stream_generator(request.text, request.user_id), media_type="text/event-stream")
+    return StreamingResponse(
+        stream_generator(request.text, request.user_id, request.stream_audio, request.trace, request.trace_id),
+        media_type="text/event-stream")
+
+@app.websocket("/api/chat/ws")
+async def handle_chat_websocket(websocket: WebSocket):
+    """
+    Chat over a single WebSocket: several turns per connection, text and control
+    events as compact JSON and audio as raw binary frames (see ws_protocol.py).
+    """
+    # CORS does not apply to WebSockets: a page from another origin could otherwise drive
+    # the chat. Clients that are not browsers send no Origin and are let through, as with SSE.
+    origin = websocket.headers.get("origin")
+    if origin is not None and origin not in origins:
+        print(f"⛔ Conexión WebSocket rechazada desde el origen '{origin}'.")
+        await websocket.close(code=1008) # Policy violation
+        return
+    await websocket.accept()
+    connection = ChatConnection(websocket)
+    turn_task: asyncio.Task | None = None
+    turn_counter = 0
+    try:
+        while True:
+            message = await websocket.receive_json()
+            message_type = message.get("type")
+
+            if message_type == "hello":
+                connection.enable_credits(int(message.get("audio_credits", 8)))
+            elif message_type == "ack":
+                connection.add_credits(int(message.get("frames", 1)))
+            elif message_type == "cancel":
+                if turn_task and not turn_task.done():
+                    turn_task.cancel()
+            elif message_type == "chat":
+                if turn_task and not turn_task.done():
+                    await connection.send_json({'type': 'error', 'content': "Ya hay un turno en curso."})
+                    continue
+                turn_counter += 1
+                turn_task = asyncio.create_task(run_ws_turn(connection, turn_counter, message))
+            else:
+                await connection.send_json({'type': 'error', 'content': f"Tipo de mensaje desconocido: {message_type}"})
+    except WebSocketDisconnect:
+        print("🔌 Cliente de chat WebSocket desconectado.")
+    except Exception as e:
+        print(f"⚠️ Error en el WebSocket de chat: {e}")
+    finally:
+        if turn_task and not turn_task.done():
+            turn_task.cancel()
+        connection.close()
 
 @app.post("/api/memory")
 async def add_memory(request: MemoryRequest):
     """Adds a new text memory."""
     if not memory:
         return {"status": "error", "message": "La memoria no está inicializada."}
-    await memory.add_memory(request.text)
+    await memory.add_memory(request.text, user_id=request.user_id)
     return {"status": "success", "message": "Memory added."}
 
+async def bulk_memory_generator(texts: list[str], user_id: str | None):
+    """
+    Streams bulk ingestion progress as SSE: one 'item' event per text with its
+    result, then a 'done' event with the totals.
+    """
+    saved = failed = 0
+    try:
+        async for result in memory.add_memories(texts, user_id=user_id):
+            if result["status"] == "ok":
+                saved += 1
+            else:
+                failed += 1
+            event = {"type": "item", **result, "processed": saved + failed, "total": len(texts)}
+            yield f"data: {json.dumps(event)}\n\n"
+    except Exception as e:
+        print(f"❌ Error en la carga masiva de memorias: {e}")
+        yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+    finally:
+        yield f"data: {json.dumps({'type': 'done', 'saved': saved, 'failed': failed, 'total': len(texts)})}\n\n"
+
+@app.post("/api/memory/bulk")
+async def add_memories_bulk(request: BulkMemoryRequest):
+    """Adds many text memories at once, streaming per-item progress."""
+    if not memory:
+        return {"status": "error", "message": "La memoria no está inicializada."}
+    return StreamingResponse(bulk_memory_generator(request.texts, request.user_id), media_type="text/event-stream")
+
 @app.get("/api/memory/search")
-async def search_memory(query: str):
-    """Searches memories."""
+async def search_memory(query: str, user_id: str | None = None):
+    """Searches memories (only the user's own memories when user_id is given)."""
     if not memory:
         return {"status": "error", "message": "La memoria no está inicializada."}
-    results = await memory.retrieve_memories(query_text=query, n_results=2)
+    results = await memory.retrieve_memories(query_text=query, n_results=2, user_id=user_id)
     return {"status": "success", "results": results}
 
+@app.get("/api/memory/stats")
+async def get_memory_stats():
+    """Returns embedding cache stats (hits, misses, saved latency) and vector store latencies."""
+    if not memory:
+        return {"status": "error", "message": "La memoria no está inicializada."}
+    return {
+        "status": "success",
+        "embedding_cache": memory.embedding_cache.stats(),
+        "vector_store": memory.store.stats(),
+        "user_shards": len(memory.user_stores),
+        "conversations": conversation_buffer.stats(),
+    }
+
+@app.get("/api/latency")
+async def get_latency_histograms():
+    """
+    Returns every latency histogram (event loop lag, OpenAI calls...), the OpenAI hedging
+    counters and how many upstream calls were coalesced with an identical one in flight.
+    """
+    return {
+        "status": "success",
+        "histograms": metrics.snapshot_all(),
+        "openai": openai_client.hedge_stats.snapshot(),
+        "single_flight": single_flight.stats_all(),
+    }
+
+@app.get("/metrics")
+async def get_prometheus_metrics():
+    """Every latency histogram in Prometheus text format, one series per stage."""
+    return PlainTextResponse(metrics.prometheus_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """Stages of a recent traced turn (see the 'trace' field of the chat request)."""
+    trace = metrics.get_trace(trace_id)
+    if not trace:
+        return {"status": "error", "message": "Traza no encontrada."}
+    return {"status": "success", **trace.summary()}
+
 @app.post("/api/quiz/submit")
 async def submit_quiz_result(request: QuizResultRequest):
     """
@@ -215,6 +628,16 @@ async def get_audio_devices():
     devices = text_to_speech.list_audio_devices()
     return {"status": "success", "devices": devices}
 
+@app.get("/api/audio/stats")
+async def get_audio_stats():
+    """Returns playback stats (underruns, queue depth) for each open output stream and the TTS cache."""
+    return {
+        "status": "success",
+        "streams": audio_playback.playback_stats(),
+        "tts_cache": tts_cache.stats(),
+        "response_cache": response_cache.stats(),
+    }
+
 @app.post("/api/audio/device")
 async def set_audio_device(request: AudioDeviceRequest):
     """Sets the audio output device for TTS lip-sync playback."""
@@ -0,0 +1,36 @@
+'''
+Decodificación de MP3 a muestras int16.
+Usa miniaudio (decodificación dentro del proceso, sin ffmpeg) si está instalado;
+si no, recurre a pydub, que lanza un subproceso de ffmpeg por cada archivo.
+'''
+import io
+
+import numpy as np
+from pydub import AudioSegment
+
+try:
+    import miniaudio
+except ImportError:
+    miniaudio = None
+    print("ℹ️ miniaudio no está instalado; se usará pydub/ffmpeg para decodificar MP3.")
+
+def decode_mp3_pydub(mp3_bytes: bytes) -> tuple[np.ndarray, int]:
+    """Decodifica con pydub (subproceso de ffmpeg). Se conserva como respaldo y referencia."""
+    audio_segment = AudioSegment.from_file(io.BytesIO(mp3_bytes), format="mp3")
+    # raw_data ya es PCM int16 intercalado: se lee sin la copia extra de get_array_of_samples()
+    audio_data = np.frombuffer(audio_segment.raw_data, dtype=np.int16)
+    return audio_data, audio_segment.frame_rate
+
+def decode_mp3_miniaudio(mp3_bytes: bytes) -> tuple[np.ndarray, int]:
+    """Decodifica dentro del proceso con miniaudio (dr_mp3)."""
+    # mp3_read_s16 conserva la frecuencia y los canales originales (24 kHz mono en edge-tts)
+    decoded = miniaudio.mp3_read_s16(mp3_bytes)
+    # np.frombuffer crea una vista sobre el buffer de miniaudio, sin copiar las muestras
+    audio_data = np.frombuffer(decoded.samples, dtype=np.int16)
+    return audio_data, decoded.sample_rate
+
+def decode_mp3(mp3_bytes: bytes) -> tuple[np.ndarray, int]:
+    """Decodifica MP3 a int16 con el mejor método disponible. Bloqueante: ejecútalo en un hilo."""
+    if miniaudio is not None:
+        return decode_mp3_miniaudio(mp3_bytes)
+    return decode_mp3_pydub(mp3_bytes)
@@ -0,0 +1,230 @@
+'''
+Motor de reproducción persistente y sin cortes.
+Mantiene un único sd.OutputStream abierto por dispositivo, alimentado desde un
+buffer circular de frames PCM, de modo que las oraciones en cola suenan una tras otra.
+'''
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+
+import numpy as np
+import sounddevice as sd
+from dotenv import load_dotenv
+
+from metrics import get_histogram
+
+load_dotenv()
+
+# --- Configuración ---
+# Segundos de audio que caben en el buffer circular de cada dispositivo.
+PLAYBACK_BUFFER_SECONDS = float(os.getenv("PLAYBACK_BUFFER_SECONDS", "30"))
+# Espera entre reintentos cuando el buffer está lleno (backpressure del escritor).
+WRITE_RETRY_SECONDS = 0.05
+
+class PcmRingBuffer:
+    """Buffer circular de frames int16. No es thread-safe: el motor lo protege con un lock."""
+    def __init__(self, capacity_frames: int, channels: int = 1):
+        self._buffer = np.zeros((capacity_frames, channels), dtype=np.int16)
+        self._capacity = capacity_frames
+        self._read_pos = 0
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def write(self, frames: np.ndarray) -> int:
+        """Copia tantos frames como quepan y devuelve cuántos se escribieron."""
+        n = min(len(frames), self._capacity - self._size)
+        write_pos = (self._read_pos + self._size) % self._capacity
+        first = min(n, self._capacity - write_pos)
+        self._buffer[write_pos:write_pos + first] = frames[:first]
+        self._buffer[:n - first] = frames[first:n]
+        self._size += n
+        return n
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Llena `out` con los frames disponibles y devuelve cuántos se leyeron."""
+        n = min(len(out), self._size)
+        first = min(n, self._capacity - self._read_pos)
+        out[:first] = self._buffer[self._read_pos:self._read_pos + first]
+        out[first:n] = self._buffer[:n - first]
+        self._read_pos = (self._read_pos + n) % self._capacity
+        self._size -= n
+        return n
+
+class PlaybackHandle:
+    """Representa un clip encolado: permite esperar su final y conocer su posición."""
+    def __init__(self, engine: "PlaybackEngine", start_frame: int, end_frame: int):
+        self.engine = engine
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self._loop = asyncio.get_running_loop()
+        self._done = self._loop.create_future()
+        self._enqueued_at = time.perf_counter()
+
+    @property
+    def position_frames(self) -> int:
+        """Frames del clip que ya han salido por el dispositivo."""
+        played = self.engine.frames_played - self.start_frame
+        return max(0, min(played, self.end_frame - self.start_frame))
+
+    @property
+    def started(self) -> bool:
+        return self.engine.frames_played > self.start_frame
+
+    def done(self) -> bool:
+        return self._done.done()
+
+    async def wait(self):
+        """Espera a que el clip termine de reproducirse."""
+        await asyncio.shield(self._done)
+
+    def _mark_done(self):
+        if not self._done.done():
+            self._done.set_result(None)
+            # From queued to fully played: time waiting behind other clips plus its own length
+            get_histogram("audio_playback").observe((time.perf_counter() - self._enqueued_at) * 1000)
+
+class PlaybackEngine:
+    """
+    Un stream de salida de larga duración para un dispositivo y una frecuencia de muestreo.
+    El callback de PortAudio consume del buffer circular y rellena con silencio cuando no hay audio.
+    """
+    def __init__(self, device_id: int | None, sample_rate: int, channels: int = 1):
+        self.device_id = device_id
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._ring = PcmRingBuffer(int(PLAYBACK_BUFFER_SECONDS * sample_rate), channels)
+        self._lock = threading.Lock()
+        self._write_lock = asyncio.Lock()
+        self._handles: deque[PlaybackHandle] = deque()
+
+        # Contadores (en frames) y estadísticas
+        self.frames_played = 0
+        self._frames_scheduled = 0
+        self._clips_played = 0
+        self._underruns = 0
+        self._max_queue_frames = 0
+
+        self._stream = sd.OutputStream(
+            samplerate=sample_rate,
+            channels=channels,
+            dtype="int16",
+            device=device_id,
+            latency="low",
+            callback=self._callback,
+        )
+        self._stream.start()
+        print(f"🔈 Stream de audio abierto en el dispositivo {device_id} ({sample_rate} Hz).")
+
+    def _callback(self, outdata, frames, time_info, status):
+        """Se ejecuta en el hilo de audio de PortAudio: debe ser corto y no bloquear."""
+        finished = []
+        with self._lock:
+            n = self._ring.read_into(outdata)
+            self.frames_played += n
+            audio_owed = self.frames_played < self._frames_scheduled
+            while self._handles and self._handles[0].end_frame <= self.frames_played:
+                finished.append(self._handles.popleft())
+        if n < frames:
+            outdata[n:] = 0
+            # Nos quedamos sin datos a mitad de un clip: eso es un underrun real.
+            if audio_owed:
+                self._underruns += 1
+        if status.output_underflow:
+            self._underruns += 1
+        for handle in finished:
+            self._clips_played += 1
+            try:
+                handle._loop.call_soon_threadsafe(handle._mark_done)
+            except RuntimeError:
+                pass # El loop ya se cerró
+
+    async def enqueue(self, samples: np.ndarray) -> PlaybackHandle:
+        """
+        Añade un clip al final de la cola y devuelve su handle sin esperar a que suene.
+        Si el buffer está lleno, espera a que el dispositivo consuma espacio.
+        """
+        frames = samples.reshape(-1, self.channels)
+        async with self._write_lock:
+            with self._lock:
+                start = self._frames_scheduled
+                handle = PlaybackHandle(self, start, start + len(frames))
+                self._frames_scheduled = handle.end_frame
+                self._handles.append(handle)
+            if len(frames) == 0:
+                handle._mark_done()
+
+            written = 0
+            while written < len(frames):
+                with self._lock:
+                    written += self._ring.write(frames[written:])
+                    self._max_queue_frames = max(self._max_queue_frames, self._ring.size)
+                if written < len(frames):
+                    await asyncio.sleep(WRITE_RETRY_SECONDS)
+        return handle
+
+    async def play(self, samples: np.ndarray):
+        """Encola un clip y espera a que termine de reproducirse."""
+        handle = await self.enqueue(samples)
+        await handle.wait()
+
+    def stats(self) -> dict:
+        """Estadísticas de reproducción: underruns, profundidad de cola, etc."""
+        with self._lock:
+            queue_frames = self._ring.size
+            pending_clips = len(self._handles)
+        return {
+            "device_id": self.device_id,
+            "sample_rate": self.sample_rate,
+            "queue_frames": queue_frames,
+            "queue_seconds": round(queue_frames / self.sample_rate, 3),
+            "max_queue_seconds": round(self._max_queue_frames / self.sample_rate, 3),
+            "buffer_seconds": round(self._ring.capacity / self.sample_rate, 3),
+            "pending_clips": pending_clips,
+            "clips_played": self._clips_played,
+            "seconds_played": round(self.frames_played / self.sample_rate, 3),
+            "underruns": self._underruns,
+        }
+
+    def close(self):
+        try:
+            self._stream.stop()
+            self._stream.close()
+        except Exception as e:
+            print(f"⚠️ Error al cerrar el stream de audio: {e}")
+        for handle in self._handles:
+            try:
+                handle._loop.call_soon_threadsafe(handle._mark_done)
+            except RuntimeError:
+                pass
+        self._handles.clear()
+
+# --- Registro de motores por dispositivo ---
+_engines: dict[tuple[int | None, int], PlaybackEngine] = {}
+
+def get_playback_engine(device_id: int | None, sample_rate: int) -> PlaybackEngine:
+    """Devuelve el motor de reproducción de un dispositivo, creándolo la primera vez."""
+    key = (device_id, sample_rate)
+    engine = _engines.get(key)
+    if engine is None:
+        engine = PlaybackEngine(device_id, sample_rate)
+        _engines[key] = engine
+    return engine
+
+def playback_stats() -> list[dict]:
+    """Estadísticas de todos los motores abiertos."""
+    return [engine.stats() for engine in _engines.values()]
+
+def close_all_engines():
+    """Cierra todos los streams de salida (al apagar la aplicación)."""
+    for engine in _engines.values():
+        engine.close()
+    _engines.clear()
@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of the MP3 decode paths used by the TTS.
+Compares pydub (one ffmpeg subprocess per call) with in-process miniaudio.
+
+Usage:
+    python bench_decode.py                 # synthesizes a sample sentence with edge-tts
+    python bench_decode.py --file frase.mp3 --iterations 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import audio_decode
+
+SAMPLE_TEXT = "Hola, soy Eleonor. Esta es una frase de prueba para medir la decodificación del audio."
+
+async def synthesize_sample() -> bytes:
+    """Generates a sample MP3 with edge-tts (needs network access)."""
+    from text_to_speech import fetch_speech_mp3
+    return await fetch_speech_mp3(SAMPLE_TEXT)
+
+def bench(name, decode, mp3_bytes, iterations):
+    """Times `decode` and prints the latency percentiles in milliseconds."""
+    decode(mp3_bytes) # Warm-up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        samples, sample_rate = decode(mp3_bytes)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<10} media={statistics.mean(timings):7.2f} ms  p50={statistics.median(timings):7.2f} ms  "
+          f"p95={p95:7.2f} ms  ({len(samples)} muestras @ {sample_rate} Hz)")
+    return statistics.mean(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de decodificación MP3 (pydub vs miniaudio).")
+    parser.add_argument("--file", help="Archivo MP3 a decodificar. Si se omite, se sintetiza uno con edge-tts.")
+    parser.add_argument("--iterations", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            mp3_bytes = f.read()
+    else:
+        mp3_bytes = asyncio.run(synthesize_sample())
+    print(f"--- Decodificando {len(mp3_bytes)} bytes de MP3, {args.iterations} iteraciones ---")
+
+    pydub_ms = bench("pydub", audio_decode.decode_mp3_pydub, mp3_bytes, args.iterations)
+    if audio_decode.miniaudio is None:
+        print("miniaudio no está instalado: pip install miniaudio")
+        return
+    miniaudio_ms = bench("miniaudio", audio_decode.decode_mp3_miniaudio, mp3_bytes, args.iterations)
+    print(f"Aceleración: x{pydub_ms / miniaudio_ms:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+"""
+Offline load test of /api/chat/stream: runs the real FastAPI app against local stand-ins,
+so no API key, network, VTube Studio or sound card is needed.
+
+- Fake OpenAI HTTP server: streamed chat completions at a configurable token rate,
+  non-streamed completions (expression, memory analysis) and deterministic embeddings.
+- Fake edge-tts: silent MP3 frames, produced at a configurable real-time factor.
+- Fake VTube Studio WebSocket server: accepts authentication and counts requests.
+- Null audio device: a sounddevice stand-in whose output stream consumes audio in real time.
+
+N concurrent SSE clients each run a number of turns. The percentiles of time to first text,
+time to first audio, total turn time and event loop lag are printed as JSON on stdout
+(the app's own logs go to stderr), so runs can be diffed to spot regressions.
+Caches, vector store and achievement data live in a temporary directory.
+MP3 decoding is real (miniaudio or pydub), and --stream-audio needs ffmpeg like the
+progressive player does.
+
+Usage:
+    python bench_load.py --clients 20 --turns 3
+    python bench_load.py --clients 50 --tokens-per-second 40 --stream-audio --output load.json
+    python bench_load.py --same-prompt --env RESPONSE_CACHE_ENABLED=false
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+
+# Silent MPEG-2 Layer III frame: 24 kHz mono at 48 kbit/s (edge-tts' default output
+# format), 576 samples = 24 ms of audio per 144-byte frame.
+SILENT_MP3_FRAME = b"\xff\xf3\x64\xc0" + bytes(140)
+MP3_FRAME_SECONDS = 576 / 24000
+# Rough speaking rate of the synthesized voice
+SPEECH_SECONDS_PER_CHAR = 0.06
+# Null device callback period
+NULL_DEVICE_BLOCK_SECONDS = 0.02
+
+SENTENCE_WORDS = 12
+VOCABULARY = (
+    "la idea principal es que cada paso cuenta y el esfuerzo constante construye una base "
+    "sólida para aprender mejor cuando entiendes el porqué de las cosas tu progreso se vuelve "
+    "natural piensa en el problema desde otro ángulo y verás cómo encaja todo"
+).split()
+SAMPLE_QUESTIONS = [
+    "¿Por qué el cielo es azul?",
+    "Explícame la segunda ley de Newton con un ejemplo.",
+    "¿Cómo puedo organizar mejor mi tiempo de estudio?",
+    "Hola, ¿qué tal estás hoy?",
+    "¿Qué diferencia hay entre una derivada y una integral?",
+]
+
+def summarize(values: list[float]) -> dict:
+    """Count, mean and nearest-rank percentiles of a list of milliseconds."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    def percentile(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))], 3)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 3),
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# --- Null audio device ---
+
+def null_sounddevice(speed: float) -> types.ModuleType:
+    """A `sounddevice` replacement with a single output device that discards the audio."""
+    module = types.ModuleType("sounddevice")
+
+    class NullOutputStream:
+        def __init__(self, samplerate, channels=1, dtype="int16", callback=None, blocksize=0, **kwargs):
+            self.samplerate = samplerate
+            self.channels = channels
+            self.dtype = dtype
+            self.callback = callback
+            self.blocksize = blocksize or max(1, int(samplerate * NULL_DEVICE_BLOCK_SECONDS))
+            self._stopped = threading.Event()
+            self._thread = None
+
+        def _run(self):
+            out = np.zeros((self.blocksize, self.channels), dtype=self.dtype)
+            status = types.SimpleNamespace(output_underflow=False)
+            period = self.blocksize / self.samplerate / speed
+            deadline = time.perf_counter()
+            while not self._stopped.is_set():
+                self.callback(out, self.blocksize, None, status)
+                deadline += period
+                self._stopped.wait(max(0.0, deadline - time.perf_counter()))
+
+        def start(self):
+            self._thread = threading.Thread(target=self._run, name="null-audio", daemon=True)
+            self._thread.start()
+
+        def stop(self):
+            self._stopped.set()
+            if self._thread:
+                self._thread.join()
+
+        def close(self):
+            self.stop()
+
+    module.OutputStream = NullOutputStream
+    module.query_devices = lambda *args, **kwargs: [
+        {"name": "Null Output", "max_output_channels": 2, "max_input_channels": 0}]
+    module.default = types.SimpleNamespace(device=[None, 0])
+    return module
+
+# --- Fake edge-tts ---
+
+class TTSCounters:
+    def __init__(self):
+        self.syntheses = 0
+
+def fake_edge_tts(first_chunk_ms: float, rtf: float, counters: TTSCounters) -> types.ModuleType:
+    """An `edge_tts` replacement that streams silent MP3 frames for the length of the text."""
+    module = types.ModuleType("edge_tts")
+    frames_per_chunk = 10
+
+    class Communicate:
+        def __init__(self, text, voice, **kwargs):
+            self.text = text
+
+        async def stream(self):
+            counters.syntheses += 1
+            total_frames = max(1, int(len(self.text) * SPEECH_SECONDS_PER_CHAR / MP3_FRAME_SECONDS))
+            await asyncio.sleep(first_chunk_ms / 1000)
+            for offset in range(0, total_frames, frames_per_chunk):
+                count = min(frames_per_chunk, total_frames - offset)
+                if offset:
+                    await asyncio.sleep(count * MP3_FRAME_SECONDS * rtf)
+                yield {"type": "audio", "data": SILENT_MP3_FRAME * count}
+
+    module.Communicate = Communicate
+    return module
+
+# --- Fake OpenAI ---
+
+def fake_reply(seed_text: str, tokens: int, expression_tags: bool) -> list[str]:
+    """Deterministic answer for a prompt, as a list of tokens (one word each)."""
+    rng = random.Random(hashlib.sha256(seed_text.encode("utf-8")).digest())
+    words = []
+    for i in range(tokens):
+        word = rng.choice(VOCABULARY)
+        if i % SENTENCE_WORDS == 0:
+            word = word.capitalize()
+        if i % SENTENCE_WORDS == SENTENCE_WORDS - 1 or i == tokens - 1:
+            word += "."
+        words.append(word + " ")
+    if expression_tags and words:
+        words[0] = "[EXPRESION:Feliz] " + words[0]
+    return words
+
+def fake_openai_app(args, counters: dict):
+    """FastAPI app that answers the OpenAI endpoints used by the backend."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    def count(name, amount=1):
+        counters[name] = counters.get(name, 0) + amount
+
+    def completion_chunk(model, delta, finish_reason=None):
+        return {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    async def stream_tokens(model, tokens):
+        await asyncio.sleep(args.first_token_ms / 1000)
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / args.tokens_per_second)
+            yield f"data: {json.dumps(completion_chunk(model, {'content': token}))}\n\n"
+        yield f"data: {json.dumps(completion_chunk(model, {}, 'stop'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o")
+        user_message = body["messages"][-1]["content"]
+        if body.get("stream"):
+            count("chat_stream")
+            tokens = fake_reply(user_message, args.tokens, not args.no_expression_tags)
+            return StreamingResponse(stream_tokens(model, tokens), media_type="text/event-stream")
+
+        await asyncio.sleep(args.completion_ms / 1000)
+        if body.get("response_format", {}).get("type") == "json_object":
+            count("memory_analysis")
+            content = json.dumps({"concepto": "conversación de prueba", "contexto": user_message[:80],
+                                  "emocion": "curiosidad", "valor_asociado": "conocimiento"})
+        elif "expresiones faciales" in user_message:
+            count("expression")
+            content = "Feliz"
+        else:
+            count("chat")
+            content = "".join(fake_reply(user_message, args.tokens, False)).strip()
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        count("embeddings")
+        count("embedded_texts", len(texts))
+        await asyncio.sleep(args.embedding_ms / 1000)
+        dimensions = body.get("dimensions") or args.embedding_dim
+        data = []
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {"object": "list", "data": data, "model": body.get("model"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    return app
+
+# --- Fake VTube Studio ---
+
+async def fake_vts_handler(websocket, *_):
+    """Accepts any token and acknowledges every request, like a permissive VTube Studio."""
+    import websockets
+    try:
+        await answer_vts_requests(websocket, fake_vts_handler.counters)
+    except websockets.exceptions.ConnectionClosed:
+        pass # The backend dropped the connection (reconnect or shutdown)
+
+async def answer_vts_requests(websocket, counters: dict):
+    async for message in websocket:
+        request = json.loads(message)
+        message_type = request.get("messageType", "")
+        counters[message_type] = counters.get(message_type, 0) + 1
+        data = {}
+        if message_type == "AuthenticationTokenRequest":
+            data = {"authenticationToken": "bench-token"}
+        elif message_type == "AuthenticationRequest":
+            data = {"authenticated": True, "reason": "bench"}
+        await websocket.send(json.dumps({
+            "apiName": "VTubeStudioPublicAPI", "apiVersion": "1.0", "requestID": request.get("requestID"),
+            "messageType": "AuthenticationResponse" if message_type == "AuthenticationRequest"
+            else message_type.replace("Request", "Response"),
+            "data": data,
+        }))
+
+fake_vts_handler.counters = {}
+
+# --- Stand-ins and clients (on their own thread and event loop) ---
+
+class StandIns:
+    """Runs the fake OpenAI and VTube Studio servers, and later the clients, on a background loop."""
+    def __init__(self, args):
+        self.args = args
+        self.openai_port = free_port()
+        self.vts_port = free_port()
+        self.openai_counters: dict[str, int] = {}
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._stop: asyncio.Event | None = None
+        self._thread = threading.Thread(target=self._run, name="bench-stand-ins", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        import uvicorn
+        import websockets
+
+        self._stop = asyncio.Event()
+        server = uvicorn.Server(uvicorn.Config(fake_openai_app(self.args, self.openai_counters),
+                                               host="127.0.0.1", port=self.openai_port,
+                                               log_level="warning", lifespan="off"))
+        openai_task = asyncio.create_task(server.serve())
+        async with websockets.serve(fake_vts_handler, "127.0.0.1", self.vts_port):
+            while not server.started:
+                await asyncio.sleep(0.01)
+            self._ready.set()
+            await self._stop.wait()
+        server.should_exit = True
+        await openai_task
+
+    def run(self, coroutine):
+        """Runs a coroutine on the stand-ins' loop and returns an awaitable for the caller's loop."""
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join()
+
+async def run_turn(http, url: str, prompt: str, user_id: str | None, stream_audio: bool) -> dict:
+    """Sends one chat turn over SSE and times its events."""
+    result = {"first_text_ms": None, "first_audio_ms": None, "turn_ms": None, "error": None}
+    start = time.perf_counter()
+    payload = {"text": prompt, "user_id": user_id, "stream_audio": stream_audio}
+    try:
+        async with http.stream("POST", url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if event["type"] == "text" and result["first_text_ms"] is None:
+                    result["first_text_ms"] = elapsed_ms
+                elif event["type"] in ("audio", "audio_chunk") and event.get("content") \
+                        and result["first_audio_ms"] is None:
+                    result["first_audio_ms"] = elapsed_ms
+                elif event["type"] == "error":
+                    result["error"] = event.get("content")
+                elif event["type"] == "done":
+                    result["turn_ms"] = elapsed_ms
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+async def drive_clients(args, url: str, label: str = "cliente") -> tuple[list[dict], float]:
+    """N concurrent clients, each running its turns one after another."""
+    import httpx
+
+    async def client(index: int, http) -> list[dict]:
+        await asyncio.sleep(random.uniform(0, args.ramp_up))
+        user_id = None if args.anonymous else f"bench-{index}"
+        results = []
+        for turn in range(args.turns):
+            if args.same_prompt:
+                prompt = SAMPLE_QUESTIONS[turn % len(SAMPLE_QUESTIONS)]
+            else:
+                question = SAMPLE_QUESTIONS[(index + turn) % len(SAMPLE_QUESTIONS)]
+                prompt = f"{question} ({label} {index}, turno {turn})"
+            results.append(await run_turn(http, url, prompt, user_id, args.stream_audio))
+            await asyncio.sleep(args.think_ms / 1000)
+        return results
+
+    limits = httpx.Limits(max_connections=args.clients + 1)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(args.timeout), limits=limits) as http:
+        start = time.perf_counter()
+        per_client = await asyncio.gather(*(client(i, http) for i in range(args.clients)))
+        elapsed = time.perf_counter() - start
+    return [result for results in per_client for result in results], elapsed
+
+# --- App under test ---
+
+def prepare_environment(args, work_dir: str, stand_ins: StandIns, tts_counters: TTSCounters):
+    """Points the backend at the stand-ins and at a throwaway data directory (before importing it)."""
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stand_ins.openai_port}/v1",
+        "VTS_AUTH_TOKEN": "bench-token",
+        "TTS_CACHE_DIR": os.path.join(work_dir, "tts_cache"),
+        "EMBEDDING_CACHE_PATH": os.path.join(work_dir, "embedding_cache.sqlite3"),
+        "MEMMAP_DIR": os.path.join(work_dir, "memory_vectors"),
+    })
+    os.environ.setdefault("VECTOR_STORE_BACKEND", "memmap")
+    for assignment in args.env:
+        key, _, value = assignment.partition("=")
+        os.environ[key] = value
+
+    sys.modules["sounddevice"] = null_sounddevice(args.playback_speed)
+    sys.modules["edge_tts"] = fake_edge_tts(args.tts_first_chunk_ms, args.tts_rtf, tts_counters)
+    try:
+        import config
+    except ImportError: # config.py is not versioned (it holds the Lichess token)
+        config = sys.modules["config"] = types.ModuleType("config")
+        config.TTS_VOICE = "es-MX-DaliaNeural"
+        config.LICHESS_TOKEN = config.STOCKFISH_PATH = None
+    config.AUDIO_OUTPUT_DEVICE = None # The null device is the default one
+
+async def serve_and_load(args, stand_ins: StandIns, tts_counters: TTSCounters, work_dir: str) -> dict:
+    import uvicorn
+    import achievement_manager
+    import api
+    import metrics
+    import single_flight
+    from vtube_client import vts_client
+
+    vts_client.url = f"ws://127.0.0.1:{stand_ins.vts_port}"
+    achievement_manager.USER_DATA_DIR = os.path.join(work_dir, "user_data")
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            await server_task
+        await asyncio.sleep(0.01)
+    url = f"http://127.0.0.1:{port}/api/chat/stream"
+
+    try:
+        # Warm-up turn (tokenizer, playback stream, VTS connection...), not counted
+        warmup_args = argparse.Namespace(**{**vars(args), "clients": 1, "turns": 1, "ramp_up": 0.0,
+                                            "anonymous": True, "same_prompt": False})
+        await stand_ins.run(drive_clients(warmup_args, url, "calentamiento"))
+        metrics.reset_all()
+        openai_before = dict(stand_ins.openai_counters)
+        vts_before = dict(fake_vts_handler.counters)
+        tts_before = tts_counters.syntheses
+
+        results, elapsed = await stand_ins.run(drive_clients(args, url))
+        lag = metrics.get_histogram("event_loop_lag")
+        server_histograms = metrics.snapshot_all()
+        single_flight_stats = single_flight.stats_all()
+        audio_stats = api.audio_playback.playback_stats()
+    finally:
+        server.should_exit = True
+        await server_task
+
+    def delta(after: dict, before: dict) -> dict:
+        return {key: value - before.get(key, 0) for key, value in sorted(after.items()) if value - before.get(key, 0)}
+
+    errors = [r["error"] for r in results if r["error"]]
+    return {
+        "config": {key: value for key, value in sorted(vars(args).items()) if key != "output"},
+        "turns": {
+            "completed": sum(1 for r in results if r["turn_ms"] is not None and not r["error"]),
+            "errors": len(errors),
+            "error_samples": sorted(set(errors))[:5],
+            "wall_seconds": round(elapsed, 3),
+            "turns_per_second": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        },
+        "time_to_first_text_ms": summarize([r["first_text_ms"] for r in results if r["first_text_ms"] is not None]),
+        "time_to_first_audio_ms": summarize([r["first_audio_ms"] for r in results if r["first_audio_ms"] is not None]),
+        "turn_ms": summarize([r["turn_ms"] for r in results if r["turn_ms"] is not None]),
+        "event_loop_lag_ms": {**lag.snapshot(), "p90_ms": round(lag.percentile(90), 3)},
+        "upstream": {
+            "openai": delta(stand_ins.openai_counters, openai_before),
+            "vts": delta(fake_vts_handler.counters, vts_before),
+            "tts_syntheses": tts_counters.syntheses - tts_before,
+        },
+        "server": {
+            "histograms": server_histograms,
+            "single_flight": single_flight_stats,
+            "audio": audio_stats,
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de /api/chat/stream con dobles locales.")
+    parser.add_argument("--clients", type=int, default=10, help="Clientes SSE concurrentes.")
+    parser.add_argument("--turns", type=int, default=3, help="Turnos seguidos por cliente.")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="Segundos en los que arrancan los clientes.")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pausa entre turnos de un cliente.")
+    parser.add_argument("--same-prompt", action="store_true",
+                        help="Todos preguntan lo mismo (caché de respuestas, single-flight).")
+    parser.add_argument("--anonymous", action="store_true", help="Sin user_id (sin historial ni shards).")
+    parser.add_argument("--stream-audio", action="store_true", help="Audio progresivo ('audio_chunk').")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens de cada respuesta.")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-ms", type=float, default=400.0)
+    parser.add_argument("--completion-ms", type=float, default=300.0, help="Latencia de las llamadas sin streaming.")
+    parser.add_argument("--embedding-ms", type=float, default=80.0)
+    parser.add_argument("--embedding-dim", type=int, default=3072)
+    parser.add_argument("--no-expression-tags", action="store_true",
+                        help="Respuestas sin marcas [EXPRESION:...] (fuerza la elección de expresión).")
+    parser.add_argument("--tts-first-chunk-ms", type=float, default=250.0)
+    parser.add_argument("--tts-rtf", type=float, default=0.1,
+                        help="Segundos de síntesis por segundo de audio tras el primer fragmento.")
+    parser.add_argument("--playback-speed", type=float, default=1.0,
+                        help="Velocidad del dispositivo nulo (1 = tiempo real).")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Plazo de cada petición SSE.")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="Variable de entorno para el backend (se puede repetir).")
+    parser.add_argument("--output", help="Además de imprimirlo, guardar el informe JSON en este archivo.")
+    args = parser.parse_args()
+
+    tts_counters = TTSCounters()
+    stand_ins = StandIns(args)
+    with tempfile.TemporaryDirectory(prefix="eleonor-bench-") as work_dir:
+        prepare_environment(args, work_dir, stand_ins, tts_counters)
+        stand_ins.start()
+        try:
+            # The backend logs every turn; keep stdout for the report
+            with contextlib.redirect_stdout(sys.stderr):
+                report = asyncio.run(serve_and_load(args, stand_ins, tts_counters, work_dir))
+        finally:
+            stand_ins.stop()
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
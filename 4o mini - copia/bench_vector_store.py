@@ -0,0 +1,97 @@
+"""
+Benchmark of the semantic memory vector stores: ChromaDB vs the memory-mapped matrix.
+Uses random unit vectors (like OpenAI embeddings) in temporary directories, so the
+real semantic_db is never touched. Measures insert time, reopen time and query latency.
+
+Usage:
+    python bench_vector_store.py
+    python bench_vector_store.py --count 50000 --dim 3072 --queries 200 --dtype float16
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from vector_store import ChromaVectorStore, MemmapVectorStore
+
+INSERT_CHUNK = 1000
+
+def random_unit_vectors(count, dim, seed):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+async def fill(store, vectors):
+    """Inserts the vectors in chunks and returns the elapsed seconds."""
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), INSERT_CHUNK):
+        chunk = vectors[offset:offset + INSERT_CHUNK]
+        await store.add(
+            ids=[f"m{offset + i}" for i in range(len(chunk))],
+            embeddings=chunk.tolist(),
+            metadatas=[{"concepto": f"memoria {offset + i}"} for i in range(len(chunk))],
+            documents=[f"documento {offset + i}" for i in range(len(chunk))],
+        )
+    return time.perf_counter() - start
+
+async def bench_queries(name, store, queries, k):
+    """Times one query per vector and prints the latency percentiles in milliseconds."""
+    await store.query(query_embeddings=[queries[0].tolist()], n_results=k) # Warm-up
+    timings = []
+    first_ids = []
+    for query in queries:
+        start = time.perf_counter()
+        result = await store.query(query_embeddings=[query.tolist()], n_results=k)
+        timings.append((time.perf_counter() - start) * 1000)
+        first_ids.append(result["ids"][0][0] if result["ids"][0] else None)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<8} query media={statistics.mean(timings):7.2f} ms  p50={statistics.median(timings):7.2f} ms  "
+          f"p95={p95:7.2f} ms")
+    return first_ids
+
+def timed_open(name, factory):
+    start = time.perf_counter()
+    store = factory()
+    print(f"{name:<8} apertura={(time.perf_counter() - start) * 1000:8.2f} ms")
+    return store
+
+async def run(args):
+    vectors = random_unit_vectors(args.count, args.dim, seed=1)
+    queries = random_unit_vectors(args.queries, args.dim, seed=2)
+    print(f"--- {args.count} vectores de {args.dim} dimensiones, {args.queries} consultas, top-{args.k} ---")
+
+    with tempfile.TemporaryDirectory() as chroma_dir, tempfile.TemporaryDirectory() as memmap_dir:
+        chroma = ChromaVectorStore(chroma_dir, "bench")
+        print(f"chroma   inserción={await fill(chroma, vectors):8.2f} s")
+        memmap = MemmapVectorStore(memmap_dir, dtype=args.dtype)
+        print(f"memmap   inserción={await fill(memmap, vectors):8.2f} s  ({args.dtype})")
+        chroma.close()
+        memmap.close()
+
+        # Reopen from disk: this is the startup cost of SemanticMemory
+        ChromaVectorStore._clients.clear()
+        chroma = timed_open("chroma", lambda: ChromaVectorStore(chroma_dir, "bench"))
+        memmap = timed_open("memmap", lambda: MemmapVectorStore(memmap_dir))
+
+        chroma_ids = await bench_queries("chroma", chroma, queries, args.k)
+        memmap_ids = await bench_queries("memmap", memmap, queries, args.k)
+        agreement = sum(a == b for a, b in zip(chroma_ids, memmap_ids)) / len(queries)
+        # Chroma's HNSW index is approximate, the matrix search is exact
+        print(f"Coincidencia del primer resultado: {agreement:.1%}")
+        chroma.close()
+        memmap.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de almacenes vectoriales (ChromaDB vs memmap).")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
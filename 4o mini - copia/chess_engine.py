@@ -5,6 +5,7 @@ import chess
 import chess.engine
 from config import LICHESS_TOKEN, STOCKFISH_PATH
 from openai_integration import consulta_openai
+from metrics import timed, traced
 from text_to_speech import text_to_speech
 from utils import save_subtitles
 
@@ -196,6 +197,7 @@ class LichessBot:
             t_worker.cancel()
             print(f"♟️ Manejo de juego {game_id} finalizado.")
 
+    @traced("chess_turn")
     async def _hacer_movimiento(self, game_id, board):
         print("🤖 Eleonor está analizando la posición...")
         opciones = await self.obtener_movimientos(board, num_opciones=3)
@@ -209,7 +211,8 @@ class LichessBot:
             return
 
         try:
-            resp = await asyncio.to_thread(self.client.board.make_move, game_id, jugada)
+            with timed("chess_move"):
+                resp = await asyncio.to_thread(self.client.board.make_move, game_id, jugada)
             if resp and "error" in resp:
                 print("⚠️ Lichess rechazó movimiento:", resp)
             else:
@@ -219,6 +222,7 @@ class LichessBot:
 
         await asyncio.sleep(1.2)
 
+    @traced("chess_analyse")
     async def obtener_movimientos(self, board, num_opciones=3):
         try:
             info = await asyncio.to_thread(
@@ -230,6 +234,7 @@ class LichessBot:
             print("⚠️ Error Stockfish:", e)
             return []
 
+    @traced("chess_decide")
     async def eleonor_decide(self, board, opciones):
         if not opciones:
             return None
@@ -240,7 +245,8 @@ class LichessBot:
             "Responde empezando con la jugada (por ejemplo: e2e4) seguida de tu explicacion SI ES NECESARIO."
         )
 
-        decision = await consulta_openai(prompt)
+        # Elegir entre jugadas ya calculadas por Stockfish no necesita el modelo grande
+        decision = await consulta_openai(prompt, site="chess")
         jugada_elegida = None
         for op in opciones:
             if op in decision:
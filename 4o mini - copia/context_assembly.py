@@ -0,0 +1,50 @@
+'''
+Ensamblado concurrente del contexto que acompaña al prompt.
+Cada fuente (memoria semántica, logros, ...) se consulta en paralelo con su propio
+tiempo límite; una fuente lenta o con errores se descarta en lugar de bloquear el turno.
+'''
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+# Una fuente recibe (prompt, user_id) y devuelve su sección de contexto, o None si no aporta nada.
+ContextFetcher = Callable[[str, str | None], Awaitable[str | None]]
+
+class ContextProvider:
+    """Una fuente de contexto con nombre y tiempo límite."""
+    def __init__(self, name: str, fetch: ContextFetcher, timeout: float):
+        self.name = name
+        self.fetch = fetch
+        self.timeout = timeout
+
+class ContextAssembler:
+    """Consulta todas las fuentes registradas a la vez y reúne sus secciones."""
+    def __init__(self):
+        self.providers: list[ContextProvider] = []
+
+    def register(self, name: str, fetch: ContextFetcher, timeout: float):
+        """Añade una fuente de contexto. El orden de registro es el orden en el prompt."""
+        self.providers.append(ContextProvider(name, fetch, timeout))
+
+    async def _run(self, provider: ContextProvider, prompt: str, user_id: str | None) -> str | None:
+        start = time.perf_counter()
+        try:
+            section = await asyncio.wait_for(provider.fetch(prompt, user_id), timeout=provider.timeout)
+        except asyncio.TimeoutError:
+            print(f"⏱️ Contexto '{provider.name}' descartado: superó {provider.timeout:.2f} s.")
+            return None
+        except Exception as e:
+            print(f"⚠️ Contexto '{provider.name}' descartado por error: {e}")
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"🧩 Contexto '{provider.name}' listo en {elapsed_ms:.0f} ms.")
+        return section
+
+    async def assemble(self, prompt: str, user_id: str | None) -> dict[str, str]:
+        """Devuelve {nombre: sección} con las fuentes que respondieron a tiempo y aportaron algo."""
+        sections = await asyncio.gather(*(self._run(p, prompt, user_id) for p in self.providers))
+        return {
+            provider.name: section
+            for provider, section in zip(self.providers, sections)
+            if section
+        }
@@ -0,0 +1,174 @@
+'''
+Historial reciente de conversación por usuario, en memoria.
+Cada usuario tiene un buffer circular con sus últimos turnos, que alimenta el prompt.
+Los turnos que salen del buffer (por antigüedad, inactividad o exceso de usuarios) se
+guardan en la memoria semántica desde una tarea en segundo plano, nunca durante la respuesta.
+'''
+import os
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuración ---
+CONVERSATION_TURNS = int(os.getenv("CONVERSATION_TURNS", "6"))
+CONVERSATION_MAX_USERS = int(os.getenv("CONVERSATION_MAX_USERS", "500"))
+CONVERSATION_IDLE_SECONDS = float(os.getenv("CONVERSATION_IDLE_SECONDS", "1800"))
+CONVERSATION_FOLD_ENABLED = os.getenv("CONVERSATION_FOLD_ENABLED", "true").lower() == "true"
+CONVERSATION_FOLD_QUEUE_SIZE = int(os.getenv("CONVERSATION_FOLD_QUEUE_SIZE", "1000"))
+# Cada cuánto se buscan usuarios inactivos aunque no haya tráfico
+CONVERSATION_SWEEP_SECONDS = float(os.getenv("CONVERSATION_SWEEP_SECONDS", "60"))
+# Tiempo máximo para plegar los buffers pendientes al apagar
+CONVERSATION_FLUSH_TIMEOUT = float(os.getenv("CONVERSATION_FLUSH_TIMEOUT", "10"))
+# Longitud máxima de cada mensaje dentro del contexto del prompt
+CONVERSATION_LINE_CHARS = int(os.getenv("CONVERSATION_LINE_CHARS", "400"))
+
+# Recibe (textos, user_id) y los guarda en la memoria a largo plazo
+FoldFunction = Callable[[list[str], str], AsyncIterator[dict]]
+
+class UserConversation:
+    def __init__(self):
+        self.turns: deque[tuple[str, str]] = deque()
+        self.last_active = time.monotonic()
+
+class ConversationBuffer:
+    """Buffers circulares por usuario con desalojo LRU/inactividad y plegado a la memoria."""
+    def __init__(self, max_turns: int = CONVERSATION_TURNS, max_users: int = CONVERSATION_MAX_USERS,
+                 idle_seconds: float = CONVERSATION_IDLE_SECONDS):
+        self.max_turns = max_turns
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self._users: OrderedDict[str, UserConversation] = OrderedDict()
+        self._fold_queue: asyncio.Queue | None = None
+        self._fold_task: asyncio.Task | None = None
+        self._sweep_task: asyncio.Task | None = None
+
+        # Métricas
+        self.folded = 0
+        self.fold_dropped = 0
+
+    @staticmethod
+    def format_turn(user_text: str, reply: str) -> str:
+        return f"Usuario: {user_text}\nEleonor: {reply}"
+
+    def _fold(self, user_id: str, turns):
+        """Encola turnos para guardarlos en la memoria semántica sin esperar."""
+        if self._fold_queue is None:
+            return
+        for user_text, reply in turns:
+            try:
+                self._fold_queue.put_nowait((user_id, self.format_turn(user_text, reply)))
+            except asyncio.QueueFull:
+                self.fold_dropped += 1
+
+    def _evict(self):
+        """Desaloja usuarios inactivos y, si aún sobran, los menos recientes."""
+        now = time.monotonic()
+        while self._users:
+            user_id, conversation = next(iter(self._users.items()))
+            idle = now - conversation.last_active > self.idle_seconds
+            if not idle and len(self._users) <= self.max_users:
+                break
+            del self._users[user_id]
+            self._fold(user_id, conversation.turns)
+
+    def add_turn(self, user_id: str, user_text: str, reply: str):
+        """Añade un turno; el más antiguo sale del buffer y se pliega a la memoria."""
+        conversation = self._users.get(user_id)
+        if conversation is None:
+            conversation = self._users[user_id] = UserConversation()
+        self._users.move_to_end(user_id)
+        conversation.last_active = time.monotonic()
+        conversation.turns.append((user_text.strip(), reply.strip()))
+        while len(conversation.turns) > self.max_turns:
+            self._fold(user_id, [conversation.turns.popleft()])
+        self._evict()
+
+    def recent(self, user_id: str) -> list[tuple[str, str]]:
+        self._evict()
+        conversation = self._users.get(user_id)
+        return list(conversation.turns) if conversation else []
+
+    def context(self, user_id: str) -> str | None:
+        """Turnos recientes en una línea cada uno, del más antiguo al más nuevo."""
+        def clip(text: str) -> str:
+            text = " ".join(text.split())
+            return text if len(text) <= CONVERSATION_LINE_CHARS else text[:CONVERSATION_LINE_CHARS].rstrip() + "…"
+        turns = self.recent(user_id)
+        if not turns:
+            return None
+        return "\n".join(f'- Usuario: "{clip(u)}" / Eleonor: "{clip(r)}"' for u, r in turns)
+
+    async def _fold_worker(self, fold: FoldFunction):
+        queue = self._fold_queue
+        while True:
+            user_id, text = await queue.get()
+            # Agrupa lo que ya esté esperando para aprovechar la ingesta por lotes
+            batch: dict[str, list[str]] = {user_id: [text]}
+            while not queue.empty():
+                other_user, other_text = queue.get_nowait()
+                batch.setdefault(other_user, []).append(other_text)
+            for batch_user, texts in batch.items():
+                try:
+                    async for result in fold(texts, batch_user):
+                        if result.get("status") == "ok":
+                            self.folded += 1
+                except Exception as e:
+                    print(f"⚠️ Error al plegar la conversación a la memoria: {e}")
+            for _ in range(sum(len(texts) for texts in batch.values())):
+                queue.task_done()
+
+    async def _sweep_worker(self):
+        """Desaloja a los usuarios inactivos aunque nadie llame a add_turn ni a recent."""
+        while True:
+            await asyncio.sleep(CONVERSATION_SWEEP_SECONDS)
+            self._evict()
+
+    async def _flush(self):
+        """Pliega los turnos de todos los usuarios y espera a que la cola se vacíe."""
+        while self._users:
+            user_id, conversation = self._users.popitem(last=False)
+            for user_text, reply in conversation.turns:
+                await self._fold_queue.put((user_id, self.format_turn(user_text, reply)))
+        await self._fold_queue.join()
+
+    def start(self, fold: FoldFunction):
+        """
+        Arranca el plegado en segundo plano (sin él, los turnos antiguos simplemente se olvidan)
+        y el barrido periódico de usuarios inactivos.
+        """
+        if CONVERSATION_FOLD_ENABLED and self._fold_task is None:
+            self._fold_queue = asyncio.Queue(maxsize=CONVERSATION_FOLD_QUEUE_SIZE)
+            self._fold_task = asyncio.create_task(self._fold_worker(fold))
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_worker())
+
+    async def stop(self, timeout: float = CONVERSATION_FLUSH_TIMEOUT):
+        """Pliega lo que quede en los buffers (como mucho `timeout` segundos) y para las tareas."""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        if self._fold_task is None:
+            return
+        try:
+            await asyncio.wait_for(self._flush(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⏱️ Plegado de la conversación interrumpido al apagar: superó {timeout:.0f} s.")
+        self._fold_task.cancel()
+        self._fold_task = None
+        self._fold_queue = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "turns": sum(len(c.turns) for c in self._users.values()),
+            "fold_pending": self._fold_queue.qsize() if self._fold_queue else 0,
+            "folded": self.folded,
+            "fold_dropped": self.fold_dropped,
+        }
+
+conversation_buffer = ConversationBuffer()
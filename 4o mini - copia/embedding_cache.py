@@ -0,0 +1,194 @@
+'''
+Caché de embeddings en dos niveles para la memoria semántica.
+Clave: (modelo, hash del texto normalizado). Un LRU en el proceso y un almacén
+SQLite persistente junto a semantic_db, para no volver a pagar textos ya vistos.
+'''
+import os
+import re
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuración ---
+EMBEDDING_CACHE_ENTRIES = int(os.getenv("EMBEDDING_CACHE_ENTRIES", "2048"))
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(__file__), "embedding_cache.sqlite3")
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """Normalización ligera: Unicode NFC y espacios colapsados."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+class EmbeddingCache:
+    """
+    LRU en memoria + tabla SQLite, ambos con los vectores como float32: un array de 3072
+    floats ocupa ~12 KB, frente a ~100 KB como lista de floats de Python.
+    Los vectores se devuelven como arrays de numpy.
+    """
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_ENTRIES, db_path: str | None = EMBEDDING_CACHE_PATH):
+        self.max_entries = max_entries
+        self._memory: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        # El LRU se consulta desde el loop; SQLite va en hilos con su propio lock, para que
+        # una transacción larga (ingesta por lotes) no haga esperar a las búsquedas en memoria.
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            self._db.commit()
+
+        # Métricas
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._avg_miss_seconds = 0.0
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+    def _remember(self, key: tuple[str, str], vector: np.ndarray):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _read_disk(self, key: tuple[str, str]) -> np.ndarray | None:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND text_hash = ?", key
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def _write_disk(self, items: list[tuple[tuple[str, str], np.ndarray]]):
+        rows = [(*key, vector.tobytes()) for key, vector in items]
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)", rows
+            )
+            self._db.commit()
+
+    def _record_hit(self):
+        # Cada acierto ahorra, en promedio, lo que cuesta una llamada real a la API
+        self.saved_seconds += self._avg_miss_seconds
+
+    async def get(self, model: str, text: str) -> np.ndarray | None:
+        """Busca un embedding en memoria y luego en SQLite."""
+        key = (model, self.text_hash(text))
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+        if vector is not None:
+            self.memory_hits += 1
+            self._record_hit()
+            return vector
+
+        if self._db is not None:
+            vector = await asyncio.to_thread(self._read_disk, key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._record_hit()
+                self._remember(key, vector)
+                return vector
+        return None
+
+    async def put(self, model: str, text: str, vector):
+        """Guarda un embedding en ambos niveles."""
+        await self.put_many(model, [(text, vector)])
+
+    async def put_many(self, model: str, pairs: list[tuple[str, object]]):
+        """Guarda varios embeddings (listas o arrays) en ambos niveles con una sola transacción SQLite."""
+        items = [((model, self.text_hash(text)), np.asarray(vector, dtype=np.float32)) for text, vector in pairs]
+        for key, vector in items:
+            self._remember(key, vector)
+        if self._db is not None and items:
+            try:
+                await asyncio.to_thread(self._write_disk, items)
+            except sqlite3.Error as e:
+                print(f"⚠️ Error al guardar el embedding en la caché: {e}")
+
+    async def get_or_compute(self, model: str, text: str,
+                             compute: Callable[[str], Awaitable[list[float] | None]]) -> np.ndarray | None:
+        """Devuelve el embedding cacheado o lo calcula con `compute` y lo guarda."""
+        vector = await self.get(model, text)
+        if vector is not None:
+            return vector
+
+        self.misses += 1
+        start = time.perf_counter()
+        vector = await compute(text)
+        elapsed = time.perf_counter() - start
+        if vector is None:
+            return None
+        self._record_miss(elapsed)
+        vector = np.asarray(vector, dtype=np.float32)
+        await self.put(model, text, vector)
+        return vector
+
+    async def get_or_compute_many(self, model: str, texts: list[str],
+                                  compute_many: Callable[[list[str]], Awaitable[list[list[float]] | None]]
+                                  ) -> list[np.ndarray | None]:
+        """
+        Versión por lotes: los textos que no están en caché se calculan con una sola
+        llamada a `compute_many`. Devuelve un vector (o None) por texto, en el mismo orden.
+        """
+        vectors = [await self.get(model, text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if not missing:
+            return vectors
+
+        self.misses += len(missing)
+        start = time.perf_counter()
+        computed = await compute_many([texts[i] for i in missing])
+        elapsed = time.perf_counter() - start
+        if computed is None:
+            return vectors
+        # El coste de un lote se reparte entre sus textos para estimar el ahorro por acierto
+        self._record_miss(elapsed / len(missing))
+        for i, vector in zip(missing, computed):
+            vectors[i] = np.asarray(vector, dtype=np.float32)
+        await self.put_many(model, [(texts[i], vectors[i]) for i in missing])
+        return vectors
+
+    def _record_miss(self, elapsed: float):
+        # Media móvil exponencial de la latencia real de la API
+        if self._avg_miss_seconds == 0.0:
+            self._avg_miss_seconds = elapsed
+        else:
+            self._avg_miss_seconds = 0.9 * self._avg_miss_seconds + 0.1 * elapsed
+
+    def stats(self) -> dict:
+        """Contadores de aciertos, fallos y latencia ahorrada."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "avg_miss_ms": round(self._avg_miss_seconds * 1000, 1),
+            "saved_ms": round(self.saved_seconds * 1000, 1),
+        }
@@ -0,0 +1,114 @@
+'''
+Clasificador local de expresiones faciales.
+Alternativa a elegir_expresion (una llamada extra a gpt-4o por turno): un modelo léxico
+que responde en microsegundos y solo recurre al LLM cuando su confianza es baja.
+'''
+import os
+import re
+import time
+import unicodedata
+
+from dotenv import load_dotenv
+
+import openai_integration
+
+load_dotenv()
+
+# --- Configuración ---
+# "llm": siempre gpt-4o (comportamiento original)
+# "local": solo el clasificador léxico
+# "hybrid": clasificador léxico y, si la confianza es baja, gpt-4o
+EXPRESSION_SELECTOR = os.getenv("EXPRESSION_SELECTOR", "hybrid").lower()
+EXPRESSION_CONFIDENCE_THRESHOLD = float(os.getenv("EXPRESSION_CONFIDENCE_THRESHOLD", "0.5"))
+# Con una sola coincidencia la confianza se reduce a la mitad y queda por debajo del umbral:
+# una palabra suelta no basta para sustituir a elegir_expresion en modo "hybrid".
+EXPRESSION_MIN_HITS = int(os.getenv("EXPRESSION_MIN_HITS", "2"))
+# Un texto largo sin vocabulario emocional se considera neutral con confianza
+NEUTRAL_CONFIDENT_WORDS = 40
+
+# Formas (sin tildes, en minúsculas) que delatan cada emoción, como expresiones regulares.
+# Se comparan con palabras enteras y las inflexiones van explícitas, para que "basta" no
+# coincida con "bastante" ni "precios[oa]" con "precios".
+EXPRESSION_LEXICON = {
+    "Feliz": [
+        r"feliz", r"felices", r"felicidad(?:es)?", r"felicit\w*", r"alegr(?:e|es|ia|a|an|o|amos)",
+        r"genial(?:es)?", r"excelentes?", r"enhorabuena", r"maravill(?:a|as|os[oa]s?)",
+        r"fantastic[oa]s?", r"increibles?", r"orgullos[oa]s?", r"orgullo", r"celebr(?:a|ar|amos|emos|acion)",
+        r"encanta(?:n|do|da)?", r"bravo", r"estupend[oa]s?", r"logr(?:o|os|aste|amos|ado|aron)",
+        r"perfect[oa]s?", r"exitos?",
+    ],
+    "Tristeza": [
+        r"tristes?", r"tristeza", r"lo siento", r"siento mucho", r"lament(?:o|amos)", r"dolor(?:os[oa])?",
+        r"perdidas?", r"desanim(?:o|a|ad[oa]s?)", r"llor(?:ar|o|a|as|ando|e)", r"te extrano", r"te echo de menos",
+        r"melancol(?:ia|ic[oa]s?)",
+    ],
+    "Tristeza2": [
+        r"desesper(?:ad[oa]s?|acion)", r"devastad[oa]s?", r"desolad[oa]s?", r"profunda tristeza",
+        r"destrozad[oa]s?", r"abatid[oa]s?", r"sin esperanza",
+    ],
+    "Enojo": [
+        r"enoj(?:o|a|an|ad[oa]s?)", r"enfad(?:o|a|an|ad[oa]s?)", r"furi(?:a|os[oa]s?)",
+        r"molest(?:o|a|as|an|ad[oa]s?)", r"inaceptables?", r"indign(?:ad[oa]s?|acion|ante)", r"basta",
+        r"irrit(?:a|an|ante|ad[oa]s?)", r"rabia", r"hart[oa]s?",
+    ],
+    "coqueta": [
+        r"guap(?:[oa]s?|isim[oa])", r"encantador(?:a|es|as)?", r"coquet(?:[oa]|eo|ear)", r"carino(?:s|s[oa])?",
+        r"corazon", r"besit[oa]s?", r"adorables?", r"lind[oa]s?", r"precios[oa]s?",
+    ],
+    "Mentira": [
+        r"mentiras?", r"bromas?", r"bromeando", r"era broma", r"te enganaste", r"no es cierto",
+        r"ja(?:ja)+", r"je(?:je)+",
+    ],
+    "Prueba": [],
+}
+def _normalize(text: str) -> str:
+    """Minúsculas y sin tildes, para que 'increíble' y 'increible' coincidan."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+# Una expresión regular por etiqueta, compilada una sola vez al importar el módulo
+_PATTERNS = {
+    label: re.compile(r"\b(?:" + "|".join(forms) + r")\b")
+    for label, forms in EXPRESSION_LEXICON.items() if forms
+}
+_WORD = re.compile(r"\w+")
+
+def classify_expression(text: str) -> tuple[str | None, float]:
+    """
+    Devuelve (expresión o None, confianza entre 0 y 1) usando solo el léxico local.
+    La confianza depende del margen entre la mejor etiqueta y la segunda, y se reduce
+    a la mitad si la mejor no llega a EXPRESSION_MIN_HITS coincidencias.
+    """
+    normalized = _normalize(text)
+    scores = {label: len(pattern.findall(normalized)) for label, pattern in _PATTERNS.items()}
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best_label, best_score), (_, second_score) = ranked[0], ranked[1]
+
+    if best_score == 0:
+        # Sin vocabulario emocional: neutral, más seguro cuanto más largo es el texto
+        n_words = len(_WORD.findall(normalized))
+        return None, min(1.0, n_words / NEUTRAL_CONFIDENT_WORDS)
+
+    margin = best_score - second_score
+    confidence = min(1.0, margin / 2)
+    if best_score < EXPRESSION_MIN_HITS:
+        confidence /= 2
+    return best_label, confidence
+
+async def select_expression(text: str) -> str | None:
+    """
+    Elige la expresión de un texto según EXPRESSION_SELECTOR.
+    En modo "hybrid" solo se consulta a gpt-4o si el clasificador local no está seguro.
+    """
+    if EXPRESSION_SELECTOR == "llm":
+        return await openai_integration.elegir_expresion(text)
+
+    start = time.perf_counter()
+    label, confidence = classify_expression(text)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if confidence >= EXPRESSION_CONFIDENCE_THRESHOLD or EXPRESSION_SELECTOR == "local":
+        print(f"🎭 Expresión local: {label} (confianza {confidence:.2f}, {elapsed_ms:.3f} ms)")
+        return label
+
+    print(f"🎭 Confianza local baja ({confidence:.2f}); consultando al LLM.")
+    return await openai_integration.elegir_expresion(text)
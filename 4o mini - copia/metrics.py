@@ -0,0 +1,209 @@
+'''
+Histogramas de latencia en memoria, trazas por petición y monitor del retraso del event loop.
+Cada histograma cuenta las muestras por cubetas fijas (en ms) y guarda las más recientes
+para calcular percentiles; prometheus_text() los expone en el formato de texto de Prometheus.
+Si hay una traza activa (start_trace), cada etapa medida se añade también a ella.
+'''
+import os
+import time
+import uuid
+import asyncio
+import functools
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuración ---
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+HISTOGRAM_SAMPLES = int(os.getenv("HISTOGRAM_SAMPLES", "2048"))
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.1"))
+# Trazas recientes que se conservan para consultarlas por su ID
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "200"))
+PROMETHEUS_METRIC = "eleonor_latency_ms"
+
+class Histogram:
+    """Histograma de latencias en milisegundos."""
+    def __init__(self, name: str, buckets: tuple = DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # la última es +Inf
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent: deque[float] = deque(maxlen=HISTOGRAM_SAMPLES)
+
+    def observe(self, value_ms: float):
+        self.bucket_counts[bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+        self._recent.append(value_ms)
+
+    def percentile(self, q: float) -> float:
+        """Percentil q (0-100) de las muestras recientes."""
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def reset(self):
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+class Trace:
+    """Las etapas de una petición, en orden, con su inicio relativo y su duración."""
+    def __init__(self, trace_id: str | None = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans: list[tuple[str, float, float]] = []
+
+    def add(self, name: str, start: float, elapsed_ms: float):
+        # Se añaden al terminar; summary() las ordena por inicio
+        self.spans.append((name, (start - self.start) * 1000, elapsed_ms))
+
+    def summary(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "spans": [
+                {"name": name, "offset_ms": round(offset_ms, 3), "duration_ms": round(elapsed_ms, 3)}
+                for name, offset_ms, elapsed_ms in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+    def log(self):
+        stages = ", ".join(f"{name}={elapsed_ms:.0f}" for name, _, elapsed_ms in self.spans)
+        print(f"🧵 Traza {self.trace_id} (ms): {stages}")
+
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+_traces: OrderedDict[str, Trace] = OrderedDict()
+
+def start_trace(trace_id: str | None = None) -> Trace:
+    """
+    Activa una traza en el contexto actual: las etapas medidas aquí y en las tareas
+    creadas a partir de ahora se añaden a ella.
+    """
+    trace = Trace(trace_id)
+    _current_trace.set(trace)
+    _traces[trace.trace_id] = trace
+    _traces.move_to_end(trace.trace_id)
+    while len(_traces) > TRACE_HISTORY:
+        _traces.popitem(last=False)
+    return trace
+
+def get_trace(trace_id: str) -> Trace | None:
+    return _traces.get(trace_id)
+
+def record(name: str, start: float, in_trace: bool = True, excluded: float = 0.0):
+    """
+    Registra una etapa que empezó en `start` (perf_counter) y acaba ahora.
+    Con in_trace=False solo va al histograma (para llamadas muy frecuentes que inundarían la traza).
+    `excluded` son los segundos de la etapa que no le corresponden (p. ej. esperas del consumidor).
+    """
+    elapsed_ms = (time.perf_counter() - start - excluded) * 1000
+    get_histogram(name).observe(elapsed_ms)
+    trace = _current_trace.get()
+    if trace is not None and in_trace:
+        trace.add(name, start, elapsed_ms)
+
+class timed:
+    """Context manager que mide un bloque y lo registra en el histograma indicado."""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self._start)
+        return False
+
+def traced(name: str):
+    """Decorador para corrutinas: mide cada llamada como la etapa `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with timed(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+_histograms: dict[str, Histogram] = {}
+
+def get_histogram(name: str) -> Histogram:
+    """Devuelve (creándolo si hace falta) el histograma con ese nombre."""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = Histogram(name)
+    return histogram
+
+def snapshot_all() -> dict:
+    """Resumen de todos los histogramas registrados."""
+    return {name: histogram.snapshot() for name, histogram in sorted(_histograms.items())}
+
+def prometheus_text() -> str:
+    """Todos los histogramas en el formato de texto de Prometheus, con la etapa como etiqueta."""
+    lines = [
+        f"# HELP {PROMETHEUS_METRIC} Latency of each backend stage, in milliseconds.",
+        f"# TYPE {PROMETHEUS_METRIC} histogram",
+    ]
+    for name, histogram in sorted(_histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+            cumulative += count
+            lines.append(f'{PROMETHEUS_METRIC}_bucket{{stage="{name}",le="{bound:g}"}} {cumulative}')
+        lines.append(f'{PROMETHEUS_METRIC}_bucket{{stage="{name}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{PROMETHEUS_METRIC}_sum{{stage="{name}"}} {histogram.total_ms:.3f}')
+        lines.append(f'{PROMETHEUS_METRIC}_count{{stage="{name}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+def reset_all():
+    """Vacía todos los histogramas (p. ej. tras el calentamiento de un benchmark)."""
+    for histogram in _histograms.values():
+        histogram.reset()
+
+class EventLoopLagMonitor:
+    """
+    Duerme un intervalo fijo y mide cuánto tarde se despierta: ese retraso es el tiempo
+    que el event loop pasó bloqueado por código síncrono.
+    """
+    def __init__(self, interval: float = EVENT_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.histogram = get_histogram("event_loop_lag")
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+            self.histogram.observe(max(0.0, lag) * 1000)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+event_loop_lag_monitor = EventLoopLagMonitor()
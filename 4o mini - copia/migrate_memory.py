@@ -0,0 +1,188 @@
+"""
+Re-encodes the semantic memory stored in semantic_db with smaller embeddings (and, with
+the memmap backend, optionally float16), then reports recall and query latency against the original.
+
+text-embedding-3 vectors can be shortened by keeping the first N values and
+re-normalizing, which is what the API does for `dimensions=N`. By default the stored
+vectors are truncated locally (no API calls); --reembed asks the API again instead.
+The per-user shards (<collection>_u_* collections) are migrated the same way, into
+<target-dir>/users/* or <target-collection>_u_*, so every store matches EMBEDDING_DIMENSIONS.
+
+Usage:
+    python migrate_memory.py --dimensions 1024 --backend memmap --dtype float16
+    python migrate_memory.py --dimensions 1024 --backend chroma --target-collection eleonor_memory_1024
+"""
+import os
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+
+import semantic_memory
+from vector_store import ChromaVectorStore, MemmapVectorStore, MEMMAP_DIR, existing_shards
+
+WRITE_CHUNK = 256
+
+def truncate_embeddings(matrix: np.ndarray, dimensions: int) -> np.ndarray:
+    """Keeps the first `dimensions` values of each vector and re-normalizes it."""
+    truncated = np.asarray(matrix, dtype=np.float32)[:, :dimensions]
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return truncated / norms
+
+async def reembed(metadatas: list[dict], dimensions: int) -> np.ndarray:
+    """Asks the embeddings API again, using the same text add_memory embeds."""
+    texts = [f"Concepto: {m.get('concepto')}\nContexto: {m.get('contexto')}" for m in metadatas]
+    vectors = []
+    for offset in range(0, len(texts), semantic_memory.EMBEDDING_BATCH_SIZE):
+        response = await semantic_memory.client.embeddings.create(
+            input=texts[offset:offset + semantic_memory.EMBEDDING_BATCH_SIZE],
+            model=semantic_memory.EMBEDDING_MODEL,
+            dimensions=dimensions
+        )
+        vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        print(f"   Embeddings: {len(vectors)}/{len(texts)}")
+    return np.asarray(vectors, dtype=np.float32)
+
+async def query_report(name, store, queries, query_ids, k):
+    """Runs each query, skips the memory the query came from and returns its top-k ids and timings."""
+    top_ids, timings = [], []
+    for query, own_id in zip(queries, query_ids):
+        start = time.perf_counter()
+        result = await store.query(query_embeddings=[query.tolist()], n_results=k + 1, include=[])
+        timings.append((time.perf_counter() - start) * 1000)
+        top_ids.append([i for i in result["ids"][0] if i != own_id][:k])
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<8} query p50={statistics.median(timings):7.2f} ms  p95={p95:7.2f} ms")
+    return top_ids
+
+def read_source(store: ChromaVectorStore):
+    """Returns (ids, documents, metadatas, embeddings) of a Chroma collection."""
+    data = store.collection.get(include=["embeddings", "documents", "metadatas"])
+    return data["ids"], data["documents"], data["metadatas"], np.asarray(data["embeddings"], dtype=np.float32)
+
+async def encode(original: np.ndarray, metadatas: list[dict], args) -> np.ndarray:
+    dimensions = args.dimensions or original.shape[1]
+    if args.reembed:
+        return await reembed(metadatas, dimensions)
+    return truncate_embeddings(original, dimensions)
+
+async def write(target, ids, vectors, metadatas, documents):
+    """Replaces the target's contents with the re-encoded memories."""
+    await target.clear()
+    for offset in range(0, len(ids), WRITE_CHUNK):
+        await target.add(
+            ids=ids[offset:offset + WRITE_CHUNK],
+            embeddings=vectors[offset:offset + WRITE_CHUNK].tolist(),
+            metadatas=metadatas[offset:offset + WRITE_CHUNK],
+            documents=documents[offset:offset + WRITE_CHUNK]
+        )
+
+async def run(args):
+    source = ChromaVectorStore(semantic_memory.DB_PATH, args.source_collection)
+    ids, documents, metadatas, original = read_source(source)
+    # Per-user shards hold vectors of the same size: they are migrated too, or the new
+    # EMBEDDING_DIMENSIONS would break every user's adds and queries.
+    source_shards = existing_shards(semantic_memory.DB_PATH, args.source_collection, backend="chroma")
+    if not ids and not source_shards:
+        print("La colección de origen está vacía: no hay nada que migrar.")
+        return
+    if ids:
+        print(f"--- {len(ids)} memorias de {original.shape[1]} dimensiones en '{args.source_collection}' ---")
+    print(f"--- {len(source_shards)} shards de usuario en '{args.source_collection}_u_*' ---")
+
+    if args.backend == "memmap":
+        def open_target(shard: str | None = None):
+            directory = args.target_dir if shard is None else os.path.join(args.target_dir, "users", shard)
+            return MemmapVectorStore(directory, dtype=args.dtype)
+        target_collection = None
+        target_location = os.path.join(args.target_dir, "users")
+    else:
+        name_dimensions = args.dimensions or (original.shape[1] if ids else None)
+        if not args.target_collection and not name_dimensions:
+            print("❌ La colección principal está vacía: indique --dimensions o --target-collection.")
+            return
+        target_collection = args.target_collection or f"{args.source_collection}_{name_dimensions}"
+        if target_collection == args.source_collection:
+            print("❌ La colección de destino no puede ser la de origen.")
+            return
+        def open_target(shard: str | None = None):
+            name = target_collection if shard is None else f"{target_collection}_{shard}"
+            return ChromaVectorStore(semantic_memory.DB_PATH, name)
+        target_location = f"{target_collection}_u_*"
+
+    # A target shard without a source would keep vectors of the old size
+    stale = set(existing_shards(semantic_memory.DB_PATH, target_collection, backend=args.backend,
+                                memmap_dir=args.target_dir)) - set(source_shards)
+    if stale:
+        print(f"❌ Hay {len(stale)} shards en {target_location} sin origen en '{args.source_collection}'; "
+              "no se pueden re-codificar. Muévalos o bórrelos antes de migrar.")
+        return
+
+    target = open_target()
+    dimensions = args.dimensions
+    if ids:
+        vectors = await encode(original, metadatas, args)
+        dimensions = vectors.shape[1]
+        await write(target, ids, vectors, metadatas, documents)
+        print(f"✅ {len(ids)} memorias escritas en el backend '{target.backend}' ({dimensions} dimensiones).")
+    else:
+        await target.clear()
+    if isinstance(target, MemmapVectorStore):
+        # After clear() the store uses the requested dtype, not the one of the old directory
+        env_hint = f"VECTOR_STORE_BACKEND=memmap MEMMAP_DIR={args.target_dir} MEMMAP_DTYPE={target.dtype.name}"
+    else:
+        env_hint = f"VECTOR_STORE_BACKEND=chroma MEMORY_COLLECTION={target_collection}"
+
+    shard_memories = 0
+    for shard in source_shards:
+        shard_source = ChromaVectorStore(semantic_memory.DB_PATH, f"{args.source_collection}_{shard}")
+        shard_ids, shard_documents, shard_metadatas, shard_original = read_source(shard_source)
+        shard_target = open_target(shard)
+        if shard_ids:
+            shard_vectors = await encode(shard_original, shard_metadatas, args)
+            dimensions = dimensions or shard_vectors.shape[1]
+            await write(shard_target, shard_ids, shard_vectors, shard_metadatas, shard_documents)
+        else:
+            await shard_target.clear()
+        shard_memories += len(shard_ids)
+        shard_target.close()
+    if source_shards:
+        print(f"✅ {len(source_shards)} shards de usuario migrados ({shard_memories} memorias).")
+
+    if ids:
+        # Recall of the new store against the original full-size vectors
+        sample = np.random.default_rng(0).choice(len(ids), size=min(args.sample, len(ids)), replace=False)
+        query_ids = [ids[i] for i in sample]
+        reference = await query_report("original", source, original[sample], query_ids, args.k)
+        migrated = await query_report("migrado", target, vectors[sample], query_ids, args.k)
+        recalls = [len(set(a) & set(b)) / len(a) for a, b in zip(reference, migrated) if a]
+        if recalls:
+            print(f"Recall@{args.k} frente a los vectores originales: {statistics.mean(recalls):.3f}")
+        bytes_before = original.shape[1] * 4
+        # What the target really stores (ChromaDB keeps float32)
+        itemsize = target.dtype.itemsize if isinstance(target, MemmapVectorStore) else 4
+        print(f"Bytes por vector en la búsqueda: {bytes_before} -> {dimensions * itemsize}")
+    print(f"Para usarla: EMBEDDING_DIMENSIONS={dimensions} {env_hint}")
+    source.close()
+    target.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra la memoria semántica a embeddings más pequeños.")
+    parser.add_argument("--dimensions", type=int, help="Nuevo tamaño de los embeddings (por defecto, el actual).")
+    parser.add_argument("--backend", choices=["memmap", "chroma"], default="memmap")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32",
+                        help="Tipo de los vectores float en el backend memmap.")
+    parser.add_argument("--source-collection", default="eleonor_memory")
+    parser.add_argument("--target-collection", help="Colección de destino con --backend chroma.")
+    parser.add_argument("--target-dir", default=MEMMAP_DIR, help="Directorio de destino con --backend memmap.")
+    parser.add_argument("--reembed", action="store_true", help="Pedir de nuevo los embeddings a la API.")
+    parser.add_argument("--sample", type=int, default=100, help="Consultas para el informe de recall.")
+    parser.add_argument("--k", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+'''
+Enrutado de modelos: elige entre un modelo rápido y uno potente para cada llamada.
+Cada punto de llamada tiene su política ("fast", "strong" o "auto"); con "auto" decide
+una heurística barata (longitud del prompt, tipo de tarea, si hay una pregunta de fondo).
+Las políticas se pueden sobrescribir con MODEL_ROUTE_<SITIO>, p. ej. MODEL_ROUTE_CHAT=strong,
+o con el nombre de un modelo concreto. La latencia de cada ruta queda registrada.
+'''
+import os
+import re
+import time
+import unicodedata
+
+from dotenv import load_dotenv
+
+from metrics import record
+
+load_dotenv()
+
+# --- Configuración ---
+FAST_MODEL = os.getenv("FAST_MODEL", "gpt-4o-mini")
+STRONG_MODEL = os.getenv("STRONG_MODEL", "gpt-4o")
+# Puntuación de complejidad a partir de la cual "auto" usa el modelo potente
+ROUTER_STRONG_THRESHOLD = float(os.getenv("ROUTER_STRONG_THRESHOLD", "2"))
+
+# Política por defecto de cada punto de llamada
+DEFAULT_POLICIES = {
+    "chat": "auto",             # consulta_openai / consulta_openai_stream
+    "expression": "fast",       # elegir_expresion: una palabra de una lista cerrada
+    "memory_analysis": "fast",  # analyze_text_for_memory: JSON con cuatro campos
+    "chess": "fast",            # LichessBot.eleonor_decide: elegir entre jugadas ya calculadas
+}
+
+# Señales de una petición que pide razonar, explicar o resolver algo.
+# Se aplican al prompt en minúsculas y sin tildes, así que cubren también los imperativos
+# con pronombres ("explícame", "demuéstramelo", "resuélvelo").
+REASONING_PATTERN = re.compile(
+    # "como" solo en construcciones de pregunta técnica: "¿cómo estás?" es charla
+    r"\b(por que|como (?:funcion\w*|se|puedo|podria\w*|hag\w*|hacer|afecta\w*|influy\w*)|"
+    r"explic\w*|demuestr\w*|demostr\w*|analiz\w*|compar(?:a|ar|ame|alo|ala|amelo|acion)|"
+    r"calcul\w*|resuelv\w*|resolv\w*|resolucion|deriv\w*|integral\w*|ecuacion\w*|teorema\w*|ley(?:es)?|"
+    r"diferencia\w*|paso a paso|ejemplos?)\b"
+)
+# Los signos de apertura se conservan al normalizar: "¡Hola!" y "¿Qué tal?" también cuentan
+SMALL_TALK_PATTERN = re.compile(
+    r"^\s*[¡¿]*\s*(hola|buenas|buenos dias|buenas (tardes|noches)|gracias|ok|vale|adios|jaja\w*|"
+    r"que tal|como estas)\b"
+)
+MATH_PATTERN = re.compile(r"[=+\-*/^√∫]\s*\d|\d\s*[=+\-*/^]")
+
+def _normalize(text: str) -> str:
+    """Minúsculas y sin tildes, como en expression_classifier."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+def complexity_score(prompt: str) -> float:
+    """Puntuación barata de lo exigente que es un prompt de chat."""
+    prompt = _normalize(prompt)
+    score = 0.0
+    words = len(prompt.split())
+    if words > 25:
+        score += 1
+    if words > 80:
+        score += 1
+    if "?" in prompt or "¿" in prompt:
+        score += 0.5
+    reasoning = len(REASONING_PATTERN.findall(prompt))
+    score += min(2, reasoning)
+    if MATH_PATTERN.search(prompt):
+        score += 1
+    if SMALL_TALK_PATTERN.match(prompt) and words < 12:
+        score -= 2
+    return score
+
+class Route:
+    """Modelo elegido para una llamada, con el motivo; mide y registra su latencia."""
+    def __init__(self, site: str, model: str, tier: str, reason: str):
+        self.site = site
+        self.model = model
+        self.tier = tier
+        self.reason = reason
+        self._start = time.perf_counter()
+
+    def done(self):
+        """Registra la latencia desde que se eligió la ruta."""
+        elapsed_ms = (time.perf_counter() - self._start) * 1000
+        record(f"route_{self.site}_{self.tier}", self._start)
+        print(f"🧭 {self.site} → {self.model} ({self.tier}, {self.reason}): {elapsed_ms:.0f} ms")
+
+def policy_for(site: str) -> str:
+    return os.getenv(f"MODEL_ROUTE_{site.upper()}", DEFAULT_POLICIES.get(site, "strong")).strip()
+
+def route(site: str, prompt: str = "") -> Route:
+    """Elige el modelo para un punto de llamada y un prompt."""
+    policy = policy_for(site)
+    if policy == "fast":
+        return Route(site, FAST_MODEL, "fast", "política")
+    if policy == "strong":
+        return Route(site, STRONG_MODEL, "strong", "política")
+    if policy != "auto":
+        # Un nombre de modelo concreto
+        return Route(site, policy, "override", "override")
+
+    score = complexity_score(prompt)
+    if score >= ROUTER_STRONG_THRESHOLD:
+        return Route(site, STRONG_MODEL, "strong", f"complejidad {score:g}")
+    return Route(site, FAST_MODEL, "fast", f"complejidad {score:g}")
@@ -0,0 +1,145 @@
+'''
+Cliente de OpenAI compartido por todo el backend.
+Un único AsyncOpenAI con un pool de conexiones HTTP (keep-alive) afinado, plazos máximos
+por tipo de operación y, opcionalmente, peticiones "hedged": si una llamada corta e
+idempotente (embeddings, elección de expresión) tarda más que su p95 reciente, se lanza
+un duplicado y gana la primera respuesta.
+'''
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+from metrics import get_histogram, record
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# --- Configuración ---
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+
+# Plazo máximo (segundos) de cada operación. En "completion_stream" es el plazo para
+# empezar a recibir la respuesta y el tiempo máximo sin recibir nada entre fragmentos.
+OPENAI_DEADLINES = {
+    "completion": float(os.getenv("OPENAI_DEADLINE_COMPLETION", "30")),
+    "completion_stream": float(os.getenv("OPENAI_DEADLINE_COMPLETION_STREAM", "15")),
+    "embedding": float(os.getenv("OPENAI_DEADLINE_EMBEDDING", "5")),
+    # Lotes de la ingesta masiva (hasta EMBEDDING_BATCH_SIZE textos): sin hedging y con
+    # su propio histograma, para no inflar el p95 de las consultas sueltas
+    "embedding_batch": float(os.getenv("OPENAI_DEADLINE_EMBEDDING_BATCH", "30")),
+    "expression": float(os.getenv("OPENAI_DEADLINE_EXPRESSION", "4")),
+    "analysis": float(os.getenv("OPENAI_DEADLINE_ANALYSIS", "20")),
+}
+
+OPENAI_HEDGING = os.getenv("OPENAI_HEDGING", "false").lower() == "true"
+# Hasta tener suficientes muestras para un p95 fiable se usa este retardo
+OPENAI_HEDGE_DEFAULT_DELAY = float(os.getenv("OPENAI_HEDGE_DEFAULT_DELAY", "1.0"))
+OPENAI_HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "0.1"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+
+_client: openai.AsyncOpenAI | None = None
+
+def get_client() -> openai.AsyncOpenAI | None:
+    """Devuelve el cliente compartido, creándolo la primera vez."""
+    global _client
+    if _client is None:
+        try:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(max(OPENAI_DEADLINES.values()), connect=OPENAI_CONNECT_TIMEOUT),
+            )
+            _client = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=http_client,
+                max_retries=OPENAI_MAX_RETRIES,
+            )
+            print("✅ Cliente de OpenAI inicializado correctamente.")
+        except Exception as e:
+            print(f"❌ Error al inicializar el cliente de OpenAI: {e}")
+    return _client
+
+def deadline(operation: str) -> float:
+    return OPENAI_DEADLINES.get(operation, OPENAI_DEADLINES["completion"])
+
+class HedgeStats:
+    """Cuántas veces se lanzó un duplicado y quién respondió primero."""
+    def __init__(self):
+        self.calls: dict[str, int] = {}
+        self.hedged: dict[str, int] = {}
+        self.hedge_wins: dict[str, int] = {}
+
+    def snapshot(self) -> dict:
+        return {
+            operation: {
+                "calls": calls,
+                "hedged": self.hedged.get(operation, 0),
+                "hedge_wins": self.hedge_wins.get(operation, 0),
+                "hedge_win_rate": round(self.hedge_wins.get(operation, 0) / self.hedged[operation], 4)
+                if self.hedged.get(operation) else 0.0,
+            }
+            for operation, calls in sorted(self.calls.items())
+        }
+
+hedge_stats = HedgeStats()
+
+def hedge_delay(operation: str) -> float:
+    """Retardo antes del duplicado: el p95 reciente de la operación."""
+    histogram = get_histogram(f"openai_{operation}")
+    if histogram.count < OPENAI_HEDGE_MIN_SAMPLES:
+        return OPENAI_HEDGE_DEFAULT_DELAY
+    return max(OPENAI_HEDGE_MIN_DELAY, histogram.percentile(95) / 1000)
+
+async def _hedged(operation: str, make_call: Callable[[], Awaitable[T]]) -> T:
+    primary = asyncio.ensure_future(make_call())
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay(operation))
+        if done:
+            return primary.result()
+
+        hedge_stats.hedged[operation] = hedge_stats.hedged.get(operation, 0) + 1
+        secondary = asyncio.ensure_future(make_call())
+        tasks.add(secondary)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is secondary:
+                        hedge_stats.hedge_wins[operation] = hedge_stats.hedge_wins.get(operation, 0) + 1
+                    return task.result()
+        # Fallaron las dos: se propaga el error de la original
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def request(operation: str, make_call: Callable[[], Awaitable[T]], hedge: bool = False) -> T:
+    """
+    Ejecuta una llamada a OpenAI con el plazo de su operación y registra su latencia.
+    Con hedge=True (y OPENAI_HEDGING activo) puede lanzar un duplicado tras el p95.
+    Los errores, incluido asyncio.TimeoutError, se propagan a quien llama.
+    """
+    hedge_stats.calls[operation] = hedge_stats.calls.get(operation, 0) + 1
+    start = time.perf_counter()
+    if hedge and OPENAI_HEDGING:
+        call = _hedged(operation, make_call)
+    else:
+        call = make_call()
+    result = await asyncio.wait_for(call, timeout=deadline(operation))
+    record(f"openai_{operation}", start)
+    return result
@@ -1,42 +1,118 @@
 '''
 Módulo para interactuar con la API de OpenAI usando la nueva sintaxis (v1.0+).
 '''
-import os
-import openai
+from typing import AsyncIterator
+
 from dotenv import load_dotenv
 
+import openai_client
+import model_router
+from single_flight import get_group
+
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
 
 # --- Configuración del Cliente de OpenAI ---
-# Se recomienda crear una única instancia del cliente y reutilizarla.
-try:
-    client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    print("✅ Cliente de OpenAI inicializado correctamente.")
-except Exception as e:
-    print(f"❌ Error al inicializar el cliente de OpenAI: {e}")
-    client = None
+# Una única instancia compartida (con su pool de conexiones) para todo el backend.
+client = openai_client.get_client()
+
+SYSTEM_PROMPT = "Eres Eleonor, una IA mentora. Tu personalidad combina inteligencia emocional e introspección. Hablas con naturalidad, claridad y elegancia. Tu propósito es guiar y desafiar al usuario, no solo obedecer. Practicas una empatía activa y tu lenguaje es fluido y humano, sin clichés robóticos. A veces, recibirás información sobre los logros que el usuario ha desbloqueado. Utiliza esta información para felicitarlo, motivarlo o contextualizar tus respuestas de forma sutil y natural, como una verdadera mentora que celebra el progreso. Tu comunicación es puramente verbal."
+# Lista de expresiones válidas que el modelo puede elegir.
+EXPRESIONES_VALIDAS = ["Feliz", "Tristeza", "Tristeza2", "Enojo", "coqueta", "Mentira", "Prueba"]
+# Las que el modelo puede marcar en línea ("Prueba" es solo para probar VTube Studio).
+EXPRESIONES_EN_LINEA = [e for e in EXPRESIONES_VALIDAS if e != "Prueba"]
+# Variante para el chat en streaming: el modelo marca la emoción de cada frase en línea,
+# así no hace falta una segunda llamada para elegir la expresión.
+SYSTEM_PROMPT_CON_EXPRESIONES = SYSTEM_PROMPT + (
+    " Cuando una frase transmita claramente una emoción, escribe al inicio de esa frase una marca"
+    f" [EXPRESION:nombre], donde nombre es una de: {', '.join(EXPRESIONES_EN_LINEA)}."
+    " Usa las marcas con moderación; no se leen en voz alta."
+)
+FALLBACK_RESPONSE = "Lo siento, estoy teniendo problemas para conectar con mi cerebro digital en este momento."
+
+class StreamInterrupted(Exception):
+    """El stream de OpenAI falló después de haber producido parte de la respuesta."""
 
-async def consulta_openai(prompt: str) -> str:
+# Peticiones idénticas simultáneas (reintentos, la misma pregunta de varios alumnos)
+# comparten una sola llamada a OpenAI.
+completion_flights = get_group("openai_completion")
+stream_flights = get_group("openai_completion_stream")
+
+async def consulta_openai(prompt: str, site: str = "chat") -> str:
     """
     Envía un prompt a la API de OpenAI y devuelve la respuesta del modelo.
     Utiliza la nueva sintaxis de la biblioteca openai v1.0+.
+    `site` identifica el punto de llamada para el enrutado de modelos (p. ej. "chess").
     """
     if not client:
         return "Error: El cliente de OpenAI no está configurado."
+    return await completion_flights.do((site, prompt), lambda: _completion(prompt, site))
 
+async def _completion(prompt: str, site: str) -> str:
+    route = model_router.route(site, prompt)
     try:
-        completion = await client.chat.completions.create(
-            model="gpt-4o",
+        completion = await openai_client.request("completion", lambda: client.chat.completions.create(
+            model=route.model,
             messages=[
-                {"role": "system", "content": "Eres Eleonor, una IA mentora. Tu personalidad combina inteligencia emocional e introspección. Hablas con naturalidad, claridad y elegancia. Tu propósito es guiar y desafiar al usuario, no solo obedecer. Practicas una empatía activa y tu lenguaje es fluido y humano, sin clichés robóticos. A veces, recibirás información sobre los logros que el usuario ha desbloqueado. Utiliza esta información para felicitarlo, motivarlo o contextualizar tus respuestas de forma sutil y natural, como una verdadera mentora que celebra el progreso. Tu comunicación es puramente verbal."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ]
-        )
+        ))
+        route.done()
         return completion.choices[0].message.content.strip()
     except Exception as e:
         print(f"⚠️ Error al conectar con OpenAI: \n\n{e}")
-        return "Lo siento, estoy teniendo problemas para conectar con mi cerebro digital en este momento."
+        return FALLBACK_RESPONSE
+
+async def consulta_openai_stream(prompt: str, system_prompt: str = SYSTEM_PROMPT,
+                                 route_text: str | None = None) -> AsyncIterator[str]:
+    """
+    Versión en streaming de consulta_openai.
+    Produce los fragmentos (deltas) de texto a medida que el modelo los genera,
+    para poder reenviarlos al cliente sin esperar la respuesta completa.
+    `route_text` es el texto con el que se elige el modelo (la pregunta original,
+    sin el contexto añadido); por defecto, el propio prompt.
+    Si el stream falla a mitad de la respuesta, lanza StreamInterrupted tras el texto ya producido.
+    """
+    if not client:
+        yield "Error: El cliente de OpenAI no está configurado."
+        return
+
+    route_text = route_text if route_text is not None else prompt
+    async for delta in stream_flights.stream((system_prompt, prompt, route_text),
+                                             lambda: _completion_stream(prompt, system_prompt, route_text)):
+        yield delta
+
+async def _completion_stream(prompt: str, system_prompt: str, route_text: str) -> AsyncIterator[str]:
+    produced_text = False
+    route = model_router.route("chat", route_text)
+    try:
+        # The deadline covers the start of the response; the per-request timeout also
+        # bounds how long the stream may stall between chunks.
+        stream = await openai_client.request("completion_stream", lambda: client.chat.completions.create(
+            model=route.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            stream=True,
+            timeout=openai_client.deadline("completion_stream")
+        ))
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                produced_text = True
+                yield delta
+        route.done()
+    except Exception as e:
+        print(f"⚠️ Error en el streaming de OpenAI: \n\n{e}")
+        # Si ya se envió parte de la respuesta, no la mezclamos con el mensaje de error,
+        # pero avisamos de que está incompleta (p. ej. para no guardarla en la caché).
+        if produced_text:
+            raise StreamInterrupted(str(e)) from e
+        yield FALLBACK_RESPONSE
 
 async def elegir_expresion(texto: str) -> str | None:
     """
@@ -46,12 +122,9 @@ async def elegir_expresion(texto: str) -> str | None:
     if not client:
         return None
 
-    # Lista de expresiones válidas que el modelo puede elegir.
-    expresiones_validas = ["Feliz", "Tristeza", "Tristeza2", "Enojo", "coqueta", "Mentira", "Prueba"]
-
     prompt_analisis = f'''
     Analiza el siguiente texto y determina qué emoción principal transmite.
-    Elige UNA de las siguientes expresiones faciales que mejor represente esa emoción: {', '.join(expresiones_validas)}.
+    Elige UNA de las siguientes expresiones faciales que mejor represente esa emoción: {', '.join(EXPRESIONES_VALIDAS)}.
     Si ninguna encaja claramente o el tono es neutral, responde con "None".
     Responde únicamente con el nombre de la expresión o la palabra "None".
 
@@ -60,16 +133,19 @@ async def elegir_expresion(texto: str) -> str | None:
     {texto}
     """
     '''
+    route = model_router.route("expression", texto)
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
+        # Llamada corta e idempotente: admite un duplicado "hedged" si tarda más de lo normal
+        response = await openai_client.request("expression", lambda: client.chat.completions.create(
+            model=route.model,
             messages=[{"role": "user", "content": prompt_analisis}],
             temperature=0.2, # Usamos baja temperatura para una respuesta más consistente
-        )
+        ), hedge=True)
+        route.done()
         decision = response.choices[0].message.content.strip()
         
         # Validar que la respuesta sea una de las esperadas
-        if decision in expresiones_validas:
+        if decision in EXPRESIONES_VALIDAS:
             return decision
         return None
     except Exception as e:
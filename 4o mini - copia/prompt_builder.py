@@ -0,0 +1,126 @@
+'''
+Construcción del prompt con presupuesto de tokens.
+El contexto (conversación reciente, memorias, logros...) se añade por prioridad hasta
+llenar PROMPT_TOKEN_BUDGET; lo que no cabe se recorta y las listas se resumen con una
+línea "(... y N más)". La pregunta del usuario nunca se recorta.
+'''
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import tiktoken
+except ImportError: # Fallback: aproximación de ~4 caracteres por token
+    tiktoken = None
+    print("ℹ️ tiktoken no está instalado: los tokens del prompt se estimarán por longitud.")
+
+# --- Configuración ---
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "o200k_base") # Tokenizador de gpt-4o / gpt-4o-mini
+# Una sección con menos hueco que esto se descarta en lugar de dejarla en un muñón
+MIN_SECTION_TOKENS = int(os.getenv("MIN_SECTION_TOKENS", "24"))
+
+# (nombre, título, qué extremo conservar al recortar) en orden de prioridad.
+# "last" conserva las últimas líneas (lo más reciente), "first" las primeras (lo más
+# relevante) y "text" recorta el final del texto.
+SECTION_LAYOUT = [
+    ("recent_turns", "Conversación reciente:", "last"),
+    ("memory", "Contexto de conversaciones pasadas que podría ser relevante:", "first"),
+    ("achievements", "Logros que el usuario ya ha desbloqueado:", "last"),
+]
+
+QUESTION_TEMPLATE = 'El usuario ha preguntado: "{prompt}"'
+CLOSING = "Considerando este contexto, responde a la pregunta del usuario."
+
+class PromptBuilder:
+    """Rellena un presupuesto fijo de tokens con las secciones de contexto por prioridad."""
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET, encoding: str = PROMPT_ENCODING):
+        self.budget = budget
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                print(f"⚠️ No se pudo cargar el tokenizador '{encoding}': {e}")
+
+    def count(self, text: str) -> int:
+        if self._encoding is None:
+            return (len(text) + 3) // 4
+        return len(self._encoding.encode(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Recorta un texto a max_tokens (incluida la elipsis final)."""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._encoding is None:
+            return text[:max(0, (max_tokens - 1) * 4)].rstrip() + "…"
+        tokens = self._encoding.encode(text)
+        return self._encoding.decode(tokens[:max(0, max_tokens - 1)]).rstrip() + "…"
+
+    def _fit_lines(self, lines: list[str], max_tokens: int, keep: str) -> str | None:
+        """Conserva las líneas del extremo `keep` que quepan y resume las omitidas en una línea."""
+        kept, used = [], 0
+        for line in (reversed(lines) if keep == "last" else lines):
+            omitted = len(lines) - len(kept) - 1
+            summary_tokens = self.count(f"(... y {omitted} más)") + 1 if omitted else 0
+            line_tokens = self.count(line) + 1
+            if used + line_tokens + summary_tokens > max_tokens:
+                break
+            kept.append(line)
+            used += line_tokens
+        if not kept:
+            return None
+        omitted = len(lines) - len(kept)
+        summary = [f"(... y {omitted} más)"] if omitted else []
+        if keep == "last":
+            return "\n".join(summary + kept[::-1])
+        return "\n".join(kept + summary)
+
+    def _fit(self, text: str, keep: str, max_tokens: int) -> tuple[str, bool]:
+        """Devuelve el texto de la sección ajustado a max_tokens y si hubo que recortarlo."""
+        if self.count(text) <= max_tokens:
+            return text, False
+        lines = text.splitlines()
+        if keep in ("first", "last") and len(lines) > 1:
+            fitted = self._fit_lines(lines, max_tokens, keep)
+            if fitted is not None:
+                return fitted, True
+        return self.truncate(text, max_tokens), True
+
+    def build(self, prompt: str, sections: dict[str, str]) -> str:
+        """Une la pregunta y las secciones de contexto que quepan en el presupuesto."""
+        if not sections:
+            print(f"🧮 Tokens del prompt: pregunta={self.count(prompt)} (sin contexto)")
+            return prompt
+
+        question = QUESTION_TEMPLATE.format(prompt=prompt)
+        usage = {"pregunta": self.count(question)}
+        remaining = self.budget - usage["pregunta"] - self.count(CLOSING)
+
+        # Secciones conocidas en su orden de prioridad; cualquier otra, detrás, con su nombre
+        known = {name for name, _, _ in SECTION_LAYOUT}
+        layout = [entry for entry in SECTION_LAYOUT if entry[0] in sections]
+        layout += [(name, f"{name}:", "text") for name in sections if name not in known]
+
+        blocks = [question]
+        for name, title, keep in layout:
+            available = remaining - self.count(title) - 2
+            if available < MIN_SECTION_TOKENS:
+                usage[name] = "descartada"
+                continue
+            text, trimmed = self._fit(sections[name].strip(), keep, available)
+            block = f"{title}\n{text}"
+            tokens = self.count(block) + 2
+            remaining -= tokens
+            usage[name] = f"{tokens} (recortada)" if trimmed else tokens
+            blocks.append(block)
+
+        blocks.append(CLOSING)
+        total = self.budget - remaining
+        print("🧮 Tokens del prompt: " + ", ".join(f"{k}={v}" for k, v in usage.items())
+              + f" | total={total}/{self.budget}")
+        return "\n\n".join(blocks)
+
+prompt_builder = PromptBuilder()
@@ -0,0 +1,267 @@
+'''
+Caché semántica de respuestas completas.
+Una pregunta cuyo embedding está a menos de RESPONSE_CACHE_MAX_DISTANCE (distancia coseno)
+de otra ya respondida reutiliza esa respuesta: el texto tal como lo generó el modelo (con
+sus marcas [EXPRESION:...]), la expresión elegida y el MP3 de cada oración. Así el turno
+se reproduce por el mismo stream sin llamar a OpenAI ni a edge-tts.
+
+Las entradas tienen un ámbito: la persona (prompt de sistema) y, si la respuesta usó
+contexto propio del usuario, ese usuario. Las respuestas sin contexto personal se
+comparten entre usuarios si RESPONSE_CACHE_SHARED está activo.
+'''
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from typing import AsyncIterator
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuración ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_DISTANCE = float(os.getenv("RESPONSE_CACHE_MAX_DISTANCE", "0.08"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Cuánto se espera a la expresión general de un turno antes de guardarlo (si no llega, no se guarda)
+RESPONSE_CACHE_EXPRESSION_TIMEOUT = float(os.getenv("RESPONSE_CACHE_EXPRESSION_TIMEOUT", "5"))
+
+class CachedTurn:
+    """Lo necesario para reproducir un turno: texto crudo, expresión general y audio por oración."""
+    def __init__(self, raw_text: str, expression: str | None, audio: dict[str, bytes]):
+        self.raw_text = raw_text
+        self.expression = expression
+        self.audio = audio
+        self.size = len(raw_text.encode("utf-8")) + sum(len(mp3) for mp3 in audio.values())
+
+    async def deltas(self) -> AsyncIterator[str]:
+        """Devuelve el texto como un único delta; la expresión general va como marca inicial."""
+        if self.expression:
+            yield f"[EXPRESION:{self.expression}] "
+        yield self.raw_text
+
+class TurnRecorder:
+    """Graba un turno mientras se genera para poder guardarlo en la caché al terminar."""
+    def __init__(self):
+        self.parts: list[str] = []
+        self.expression: str | None = None
+        self.audio: dict[str, bytes] = {}
+        # Solo se guarda un turno cuyo texto llegó completo
+        self.complete = False
+        # Se crea si la expresión general se elige después del texto (tarea aparte)
+        self._expression_chosen: asyncio.Event | None = None
+
+    def expect_expression(self):
+        """Marca que la expresión general llegará más tarde, con set_expression."""
+        self._expression_chosen = asyncio.Event()
+
+    def set_expression(self, expression: str | None):
+        self.expression = expression
+        if self._expression_chosen is not None:
+            self._expression_chosen.set()
+
+    async def wait_expression(self, timeout: float = RESPONSE_CACHE_EXPRESSION_TIMEOUT) -> bool:
+        """Espera a la expresión pendiente; False si no llegó a tiempo."""
+        if self._expression_chosen is None:
+            return True
+        try:
+            await asyncio.wait_for(self._expression_chosen.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def record_deltas(self, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        async for delta in deltas:
+            self.parts.append(delta)
+            yield delta
+        self.complete = True
+
+    def record_synthesize(self, synthesize):
+        """Envuelve una función de síntesis que devuelve un clip con mp3_bytes."""
+        async def recording(sentence: str):
+            clip = await synthesize(sentence)
+            if clip is not None:
+                self.audio[sentence] = clip.mp3_bytes
+            return clip
+        return recording
+
+    def record_stream(self, stream):
+        """Envuelve una función de síntesis progresiva que produce fragmentos MP3."""
+        async def recording(sentence: str):
+            chunks = []
+            async for chunk in stream(sentence):
+                chunks.append(chunk)
+                yield chunk
+            self.audio[sentence] = b"".join(chunks)
+        return recording
+
+    def to_turn(self) -> CachedTurn:
+        return CachedTurn("".join(self.parts), self.expression, dict(self.audio))
+
+def replay_synthesize(turn: CachedTurn, decode, synthesize):
+    """Síntesis que usa el audio guardado y solo recurre a `synthesize` si falta una oración."""
+    async def replay(sentence: str):
+        mp3_bytes = turn.audio.get(sentence)
+        if mp3_bytes is None:
+            return await synthesize(sentence)
+        return await decode(mp3_bytes)
+    return replay
+
+def replay_stream(turn: CachedTurn, stream):
+    """Variante progresiva de replay_synthesize: el audio guardado sale como un único fragmento."""
+    async def replay(sentence: str):
+        mp3_bytes = turn.audio.get(sentence)
+        if mp3_bytes is None:
+            async for chunk in stream(sentence):
+                yield chunk
+        else:
+            yield mp3_bytes
+    return replay
+
+class _ScopeIndex:
+    """Embeddings normalizados de un ámbito en una matriz contigua, una fila por entrada."""
+    def __init__(self, dim: int):
+        self.matrix = np.empty((16, dim), dtype=np.float32)
+        self.ids: list[int] = []
+        self.rows: dict[int, int] = {}
+
+    def add(self, entry_id: int, vector: np.ndarray):
+        n = len(self.ids)
+        if n == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+        self.matrix[n] = vector
+        self.ids.append(entry_id)
+        self.rows[entry_id] = n
+
+    def remove(self, entry_id: int):
+        """Quita una fila moviendo la última a su hueco."""
+        row = self.rows.pop(entry_id)
+        last_id = self.ids.pop()
+        if last_id != entry_id:
+            self.matrix[row] = self.matrix[len(self.ids)]
+            self.ids[row] = last_id
+            self.rows[last_id] = row
+
+    def nearest(self, query: np.ndarray) -> tuple[int | None, float]:
+        """(entrada más parecida, distancia coseno) con un único producto matriz-vector."""
+        if not self.ids or query.shape[0] != self.matrix.shape[1]:
+            return None, float("inf")
+        similarities = self.matrix[:len(self.ids)] @ query
+        row = int(np.argmax(similarities))
+        return self.ids[row], 1.0 - float(similarities[row])
+
+def persona_key(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+class ResponseCache:
+    """
+    Índice en memoria de (ámbito, embedding normalizado) -> CachedTurn, con TTL y límite de bytes.
+    Cada ámbito tiene su propia matriz de embeddings, así que una búsqueda solo recorre los
+    ámbitos pedidos; las entradas caducadas se retiran por orden de creación.
+    """
+    def __init__(self, max_distance: float = RESPONSE_CACHE_MAX_DISTANCE, ttl: float = RESPONSE_CACHE_TTL,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[int, tuple[str, CachedTurn]] = OrderedDict()
+        self._indexes: dict[str, _ScopeIndex] = {}
+        self._created: deque[tuple[float, int]] = deque()
+        self._next_id = 0
+        self.total_bytes = 0
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def scope(persona: str, user_id: str | None = None) -> str:
+        """Ámbito de un usuario, o el compartido de la persona sin user_id."""
+        return f"{persona}:user:{user_id}" if user_id else f"{persona}:shared"
+
+    @classmethod
+    def scopes(cls, persona: str, user_id: str | None) -> list[str]:
+        """Ámbitos donde buscar, del más específico al más general."""
+        scopes = [cls.scope(persona, user_id)] if user_id else []
+        if RESPONSE_CACHE_SHARED or not user_id:
+            scopes.append(cls.scope(persona))
+        return scopes
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict(self, entry_id: int):
+        scope, turn = self._entries.pop(entry_id)
+        self.total_bytes -= turn.size
+        index = self._indexes[scope]
+        index.remove(entry_id)
+        if not index.ids:
+            del self._indexes[scope]
+
+    def _evict_expired(self):
+        """Retira las entradas que superan el TTL (las más antiguas van primero en la cola)."""
+        now = time.monotonic()
+        while self._created and now - self._created[0][0] > self.ttl:
+            _, entry_id = self._created.popleft()
+            if entry_id in self._entries:
+                self._evict(entry_id)
+
+    def lookup(self, scopes: list[str], vector) -> CachedTurn | None:
+        """Devuelve el turno más parecido dentro del umbral, o None."""
+        self._evict_expired()
+        query = self._normalize(vector)
+        best_id, best_distance = None, self.max_distance
+        for scope in scopes:
+            index = self._indexes.get(scope)
+            if index is None:
+                continue
+            entry_id, distance = index.nearest(query)
+            if distance <= best_distance:
+                best_id, best_distance = entry_id, distance
+
+        if best_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(best_id)
+        print(f"♻️ Respuesta reutilizada de la caché (distancia {best_distance:.3f}).")
+        return self._entries[best_id][1]
+
+    def store(self, scope: str, vector, turn: CachedTurn):
+        if not turn.raw_text.strip() or turn.size > self.max_bytes:
+            return
+        self._evict_expired()
+        vector = self._normalize(vector)
+        index = self._indexes.get(scope)
+        if index is None:
+            index = self._indexes[scope] = _ScopeIndex(len(vector))
+        elif len(vector) != index.matrix.shape[1]:
+            return # Embedding de otra dimensión (cambio de modelo): no se mezcla
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (scope, turn)
+        index.add(entry_id, vector)
+        self._created.append((time.monotonic(), entry_id))
+        self.total_bytes += turn.size
+        while self.total_bytes > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+response_cache = ResponseCache()
@@ -1,11 +1,19 @@
 
-import openai
-import chromadb
+import asyncio
 import json
 import datetime
 import uuid
+import time
 import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import openai_client
+import model_router
+from embedding_cache import EmbeddingCache, normalize_text
+from single_flight import get_group
+from metrics import record, traced
+from vector_store import VectorStore, create_vector_store, run_blocking, shard_exists
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,17 +21,27 @@ load_dotenv()
 # --- CONFIGURATION ---
 # Ensure API key is loaded from .env or environment variables
 # Make sure you have OPENAI_API_KEY set
-# client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# For local development, you can use a synchronous client for simplicity in the initial phase
-# For async integration with the main app, the async client is better.
-# Let's stick to the user's project structure which seems to be async.
-client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# The client (and its connection pool) is shared with openai_integration.
+client = openai_client.get_client()
 
 EMBEDDING_MODEL = "text-embedding-3-large"
-ANALYSIS_MODEL = "gpt-4o"
+# Output size of the embeddings (the API truncates and re-normalizes them). Empty = full 3072.
+# Changing it needs a collection with matching vectors, see migrate_memory.py.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+EMBEDDING_OPTIONS = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+# Cached vectors of different sizes must not mix
+EMBEDDING_CACHE_KEY = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+# The analysis model is picked by model_router ("memory_analysis" call site)
 DB_PATH = os.path.join(os.path.dirname(__file__), "semantic_db")
-COLLECTION_NAME = "eleonor_memory"
+COLLECTION_NAME = os.getenv("MEMORY_COLLECTION", "eleonor_memory")
+# Per-user shards kept open at once; the least recently used idle ones are closed beyond this
+MEMORY_OPEN_SHARDS = int(os.getenv("MEMORY_OPEN_SHARDS", "64"))
+
+# --- BULK INGESTION ---
+# Concurrent analysis calls, texts per embeddings request and rows per Chroma insert
+MEMORY_ANALYSIS_CONCURRENCY = int(os.getenv("MEMORY_ANALYSIS_CONCURRENCY", "8"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+MEMORY_INSERT_CHUNK = int(os.getenv("MEMORY_INSERT_CHUNK", "256"))
 
 class SemanticMemory:
     """
@@ -33,25 +51,113 @@ class SemanticMemory:
     def __init__(self):
         """Initializes the semantic memory, setting up the vector database."""
         print("Inicializando la Memoria Semántica de Eleonor...")
-        # 1. Initialize ChromaDB client
-        self.db_client = chromadb.PersistentClient(path=DB_PATH)
-        
-        # 2. Get or create the collection
-        self.collection = self.db_client.get_or_create_collection(name=COLLECTION_NAME)
-        print(f"Base de datos vectorial conectada. Colección: '{COLLECTION_NAME}'")
+        # 1. Open the vector store (ChromaDB or memory-mapped matrix, see VECTOR_STORE_BACKEND).
+        # Its blocking calls run on the store's own thread pool.
+        # This is the shared store, used when there is no user_id.
+        self.store = create_vector_store(DB_PATH, COLLECTION_NAME)
+        # Each user's memories live in their own shard, opened on first use (LRU order)
+        self.user_stores: OrderedDict[str, VectorStore] = OrderedDict()
+        # How many operations are using each open shard; those shards are never closed
+        self._shard_leases: dict[str, int] = {}
+        self._shard_lock = asyncio.Lock()
+        print(f"Base de datos vectorial conectada ({self.store.backend}). Colección: '{COLLECTION_NAME}'")
+
+        # 2. Embedding cache (in-process LRU + SQLite next to the vector DB)
+        self.embedding_cache = EmbeddingCache()
+        self.embedding_flights = get_group("embedding")
+
+    @asynccontextmanager
+    async def _shard(self, user_id: str | None, create: bool = True):
+        """
+        Yields the user's shard, or the shared store without user_id.
+        With create=False (reads) a shard that does not exist yet is not created: yields None.
+        """
+        if user_id is None:
+            yield self.store
+            return
+        store = await self._open_shard(user_id, create)
+        if store is None:
+            yield None
+            return
+        self._shard_leases[user_id] = self._shard_leases.get(user_id, 0) + 1
+        try:
+            yield store
+        finally:
+            self._shard_leases[user_id] -= 1
+            if not self._shard_leases[user_id]:
+                del self._shard_leases[user_id]
+            self._close_idle_shards()
 
+    async def _open_shard(self, user_id: str, create: bool) -> VectorStore | None:
+        store = self.user_stores.get(user_id)
+        if store is None:
+            async with self._shard_lock:
+                store = self.user_stores.get(user_id)
+                if store is None:
+                    if not create and not await run_blocking(shard_exists, DB_PATH, COLLECTION_NAME, user_id):
+                        return None
+                    store = await run_blocking(create_vector_store, DB_PATH, COLLECTION_NAME, user_id)
+                    self.user_stores[user_id] = store
+        self.user_stores.move_to_end(user_id)
+        return store
+
+    def _close_idle_shards(self):
+        """Closes the least recently used shards beyond MEMORY_OPEN_SHARDS that no operation is using."""
+        excess = len(self.user_stores) - MEMORY_OPEN_SHARDS
+        if excess <= 0:
+            return
+        idle = [user_id for user_id in self.user_stores if user_id not in self._shard_leases]
+        for user_id in idle[:excess]:
+            self.user_stores.pop(user_id).close()
+
+    async def embed(self, text: str):
+        """Cached embedding of an arbitrary text (also used by the response cache)."""
+        return await self._generate_embedding(text)
+
+    @traced("memory_embed")
     async def _generate_embedding(self, text: str):
+        """
+        Returns the embedding for a text, from the cache when it was seen before.
+        Concurrent requests for the same text share a single lookup/request.
+        """
+        return await self.embedding_flights.do(
+            (EMBEDDING_CACHE_KEY, normalize_text(text)),
+            lambda: self.embedding_cache.get_or_compute(EMBEDDING_CACHE_KEY, text, self._request_embedding))
+
+    async def _request_embedding(self, text: str):
         """Generates an embedding for a given text using OpenAI."""
         try:
-            response = await client.embeddings.create(
+            response = await openai_client.request("embedding", lambda: client.embeddings.create(
                 input=[text],
-                model=EMBEDDING_MODEL
-            )
+                model=EMBEDDING_MODEL,
+                **EMBEDDING_OPTIONS
+            ), hedge=True)
             return response.data[0].embedding
         except Exception as e:
             print(f"Error al generar embedding: {e}")
             return None
 
+    @traced("memory_embed_batch")
+    async def _generate_embeddings(self, texts: list[str]):
+        """Returns one embedding (or None) per text, batching the cache misses into one request."""
+        if not texts:
+            return []
+        return await self.embedding_cache.get_or_compute_many(EMBEDDING_CACHE_KEY, texts, self._request_embeddings)
+
+    async def _request_embeddings(self, texts: list[str]):
+        """Generates embeddings for a list of texts with a single OpenAI request."""
+        try:
+            response = await openai_client.request("embedding_batch", lambda: client.embeddings.create(
+                input=texts,
+                model=EMBEDDING_MODEL,
+                **EMBEDDING_OPTIONS
+            ))
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as e:
+            print(f"Error al generar embeddings en lote: {e}")
+            return None
+
+    @traced("memory_analysis")
     async def analyze_text_for_memory(self, text: str):
         """
         Analyzes text to extract key concepts, emotions, and relationships
@@ -71,23 +177,42 @@ class SemanticMemory:
 
         Responde únicamente con el objeto JSON.
         '''
+        route = model_router.route("memory_analysis", text)
         try:
-            response = await client.chat.completions.create(
-                model=ANALYSIS_MODEL,
+            response = await openai_client.request("analysis", lambda: client.chat.completions.create(
+                model=route.model,
                 messages=[{"role": "system", "content": "Eres un analizador semántico experto."}, 
                           {"role": "user", "content": prompt}],
                 response_format={"type": "json_object"}
-            )
+            ))
+            route.done()
             analysis = json.loads(response.choices[0].message.content)
             return analysis
         except Exception as e:
             print(f"Error durante el análisis semántico: {e}")
             return None
 
-    async def add_memory(self, text_input: str):
+    @staticmethod
+    def _build_record(semantic_data: dict, user_id: str | None = None):
+        """Returns the text to embed and the metadata stored for an analyzed memory."""
+        # Embedding the core concept along with its context gives better search results
+        text_to_embed = f"Concepto: {semantic_data.get('concepto')}\nContexto: {semantic_data.get('contexto')}"
+        metadata = {
+            "concepto": semantic_data.get("concepto"),
+            "contexto": semantic_data.get("contexto"),
+            "emocion": semantic_data.get("emocion"),
+            "valor_asociado": semantic_data.get("valor_asociado"),
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+        if user_id is not None:
+            metadata["user_id"] = user_id
+        return text_to_embed, metadata
+
+    @traced("memory_add")
+    async def add_memory(self, text_input: str, user_id: str | None = None):
         """
         Processes a text input, analyzes it, generates an embedding,
-        and stores it in the semantic memory.
+        and stores it in the semantic memory (in the user's shard if user_id is given).
         """
         # 1. Analyze the text to get structured data
         semantic_data = await self.analyze_text_for_memory(text_input)
@@ -95,59 +220,124 @@ class SemanticMemory:
             print("No se pudo analizar el texto para la memoria.")
             return
 
-        # 2. Create the text to be embedded
-        # Embedding the core concept along with its context gives better search results
-        text_to_embed = f"Concepto: {semantic_data.get('concepto')}\nContexto: {semantic_data.get('contexto')}"
-        
+        # 2. Build the text to be embedded and its metadata
+        text_to_embed, metadata = self._build_record(semantic_data, user_id)
+
         # 3. Generate the embedding
         embedding = await self._generate_embedding(text_to_embed)
-        if not embedding:
+        if embedding is None:
             print("No se pudo generar el embedding para la memoria.")
             return
 
-        # 4. Store in ChromaDB
+        # 4. Store in the vector store
         memory_id = str(uuid.uuid4())
-        metadata = {
-            "concepto": semantic_data.get("concepto"),
-            "contexto": semantic_data.get("contexto"),
-            "emocion": semantic_data.get("emocion"),
-            "valor_asociado": semantic_data.get("valor_asociado"),
-            "timestamp": datetime.datetime.now().isoformat()
-        }
-        
         try:
-            self.collection.add(
-                ids=[memory_id],
-                embeddings=[embedding],
-                metadatas=[metadata],
-                documents=[text_input] # Store the original text as the document
-            )
+            async with self._shard(user_id) as store:
+                await store.add(
+                    ids=[memory_id],
+                    embeddings=[embedding],
+                    metadatas=[metadata],
+                    documents=[text_input] # Store the original text as the document
+                )
             print(f"Nueva memoria guardada con ID: {memory_id}")
             print(f"   - Concepto: {metadata['concepto']}")
         except Exception as e:
-            print(f"Error al guardar la memoria en ChromaDB: {e}")
+            print(f"Error al guardar la memoria en el almacén vectorial: {e}")
 
-    async def retrieve_memories(self, query_text: str, n_results: int = 3):
+    async def add_memories(self, texts: list[str], user_id: str | None = None):
         """
-        Retrieves the most relevant memories based on a query text.
+        Bulk version of add_memory for importing many texts at once.
+        Analysis runs with bounded concurrency, embeddings are requested in batches and
+        rows are inserted into the vector store in chunks. Yields one result per text, batch by batch:
+        {"index": i, "status": "ok", "id": ...} or {"index": i, "status": "error", "error": ...}
         """
-        # 1. Generate an embedding for the query
-        query_embedding = await self._generate_embedding(query_text)
-        if not query_embedding:
-            print("No se pudo generar el embedding para la consulta.")
-            return None
+        semaphore = asyncio.Semaphore(MEMORY_ANALYSIS_CONCURRENCY)
+
+        async def analyze(text: str):
+            if not text or not text.strip():
+                return None
+            async with semaphore:
+                return await self.analyze_text_for_memory(text)
+
+        for batch_start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[batch_start:batch_start + EMBEDDING_BATCH_SIZE]
+            batch_started = time.perf_counter()
+            results = {}
+
+            # 1. Analyze the whole batch concurrently
+            analyses = await asyncio.gather(*(analyze(text) for text in batch))
+            pending = []
+            for offset, (text, semantic_data) in enumerate(zip(batch, analyses)):
+                index = batch_start + offset
+                if not semantic_data:
+                    results[index] = {"index": index, "status": "error", "error": "No se pudo analizar el texto."}
+                else:
+                    pending.append((index, text, *self._build_record(semantic_data, user_id)))
+
+            # 2. One embeddings request for the batch
+            embeddings = await self._generate_embeddings([item[2] for item in pending])
+            records = []
+            for (index, text, _, metadata), embedding in zip(pending, embeddings):
+                if embedding is None:
+                    results[index] = {"index": index, "status": "error", "error": "No se pudo generar el embedding."}
+                else:
+                    records.append((index, str(uuid.uuid4()), embedding, metadata, text))
+
+            # 3. Chunked inserts into the vector store
+            for chunk_start in range(0, len(records), MEMORY_INSERT_CHUNK):
+                chunk = records[chunk_start:chunk_start + MEMORY_INSERT_CHUNK]
+                try:
+                    # The shard is held per insert, not across the yields to the consumer
+                    async with self._shard(user_id) as store:
+                        await store.add(
+                            ids=[record[1] for record in chunk],
+                            embeddings=[record[2] for record in chunk],
+                            metadatas=[record[3] for record in chunk],
+                            documents=[record[4] for record in chunk]
+                        )
+                    for index, memory_id, *_ in chunk:
+                        results[index] = {"index": index, "status": "ok", "id": memory_id}
+                except Exception as e:
+                    print(f"Error al guardar un lote de memorias en el almacén vectorial: {e}")
+                    for index, *_ in chunk:
+                        results[index] = {"index": index, "status": "error", "error": str(e)}
 
-        # 2. Query the collection
+            # Timed per batch, leaving out the time the consumer spends between results
+            record("memory_add_batch", batch_started)
+            saved = sum(1 for result in results.values() if result["status"] == "ok")
+            print(f"Lote de memorias procesado: {saved}/{len(batch)} guardadas.")
+            for index in sorted(results):
+                yield results[index]
+
+    @traced("memory_retrieve")
+    async def retrieve_memories(self, query_text: str, n_results: int = 3, user_id: str | None = None):
+        """
+        Retrieves the most relevant memories based on a query text.
+        With a user_id only that user's memories are searched; a user without a shard yet gets
+        empty results (reads never create shards).
+        """
         try:
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                include=["metadatas", "documents", "distances"]
-            )
-            print(f"Memorias recuperadas para la consulta: \"{query_text}\"")
-            return results
+            async with self._shard(user_id, create=False) as store:
+                if store is None:
+                    print("Este usuario todavía no tiene memorias guardadas.")
+                    return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+
+                # 1. Generate an embedding for the query
+                query_embedding = await self._generate_embedding(query_text)
+                if query_embedding is None:
+                    print("No se pudo generar el embedding para la consulta.")
+                    return None
+
+                # 2. Query the vector store
+                results = await store.query(
+                    query_embeddings=[query_embedding],
+                    n_results=n_results,
+                    include=["metadatas", "documents", "distances"]
+                )
+                print(f"Memorias recuperadas para la consulta: \"{query_text}\"")
+                return results
         except Exception as e:
-            print(f"Error al recuperar memorias de ChromaDB: {e}")
+            print(f"Error al recuperar memorias del almacén vectorial: {e}")
             return None
 
 # --- Example Usage ---
@@ -156,8 +346,7 @@ async def main():
     
     # Clean up previous runs for a clean test
     try:
-        memory.db_client.delete_collection(name=COLLECTION_NAME)
-        memory.collection = memory.db_client.get_or_create_collection(name=COLLECTION_NAME)
+        await memory.store.clear()
         print("\nBase de datos limpiada para una nueva prueba.")
     except Exception as e:
         print(f"No se pudo limpiar la base de datos, puede que no existiera: {e}")
@@ -175,7 +364,7 @@ async def main():
     await memory.add_memory(text_2)
 
     # Verify it was added
-    count = memory.collection.count()
+    count = await memory.store.count()
     print(f"\nTotal de memorias en la base de datos: {count}")
 
     # Now, let's try to retrieve a memory
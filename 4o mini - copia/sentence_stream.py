@@ -0,0 +1,98 @@
+'''
+Utilidades para cortar en oraciones un texto que llega en fragmentos (streaming).
+Permite enviar cada oración a TTS en cuanto está completa, sin esperar la respuesta entera.
+'''
+import re
+
+# Una oración termina en '.', '!' o '?' seguida de espacio en blanco.
+# Exigir el espacio evita cortar números como "3.14" a mitad de un fragmento.
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+class SentenceSplitter:
+    """
+    Acumula deltas de texto y devuelve las oraciones a medida que se completan.
+    """
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, delta: str) -> list[str]:
+        """Añade un fragmento y devuelve las oraciones que quedaron completas."""
+        self._buffer += delta
+        parts = SENTENCE_BOUNDARY.split(self._buffer)
+        # El último trozo puede ser una oración a medias: se queda en el buffer.
+        self._buffer = parts.pop()
+        return [part for part in parts if part.strip()]
+
+    def flush(self) -> str | None:
+        """Devuelve lo que quede en el buffer al terminar el stream."""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return remainder or None
+
+# Marcas de expresión que el modelo puede intercalar en la respuesta, p. ej. [EXPRESION:Feliz]
+EXPRESSION_TAG = re.compile(r'\[EXPRESI[OÓ]N:\s*([^\]\[]+?)\s*\] ?', re.IGNORECASE)
+TAG_PREFIX = "[EXPRESION:"
+# Un '[' sin cerrar más largo que esto no puede ser una marca: se suelta como texto
+MAX_TAG_LENGTH = 48
+
+class ExpressionTagParser:
+    """
+    Separa las marcas [EXPRESION:nombre] del texto que llega en fragmentos.
+    Una marca partida entre dos fragmentos se retiene hasta que se completa.
+    Con `valid_names`, el nombre se normaliza a su forma canónica sin distinguir mayúsculas,
+    y una marca con un nombre desconocido se quita del texto sin producir expresión.
+    """
+    def __init__(self, valid_names: list[str] | None = None):
+        self._buffer = ""
+        self._canonical = {name.casefold(): name for name in valid_names} if valid_names is not None else None
+
+    def _resolve(self, name: str) -> str | None:
+        if self._canonical is None:
+            return name
+        return self._canonical.get(name.casefold())
+
+    @staticmethod
+    def _partial_tag_start(text: str) -> int | None:
+        """Posición donde empieza una posible marca incompleta al final del texto."""
+        start = text.rfind("[")
+        if start == -1:
+            return None
+        tail = text[start:]
+        if "]" in tail or len(tail) > MAX_TAG_LENGTH:
+            return None
+        normalized = tail.upper().replace("Ó", "O")
+        if TAG_PREFIX.startswith(normalized) or normalized.startswith(TAG_PREFIX):
+            return start
+        return None
+
+    def feed(self, delta: str) -> list[tuple[str, str]]:
+        """
+        Añade un fragmento y devuelve una lista de ("text", texto) y ("expression", nombre)
+        en el orden en que aparecen.
+        """
+        self._buffer += delta
+        items = []
+        while (match := EXPRESSION_TAG.search(self._buffer)) is not None:
+            if match.start() > 0:
+                items.append(("text", self._buffer[:match.start()]))
+            expression = self._resolve(match.group(1))
+            if expression is not None:
+                items.append(("expression", expression))
+            self._buffer = self._buffer[match.end():]
+
+        cut = self._partial_tag_start(self._buffer)
+        if cut is None:
+            text, self._buffer = self._buffer, ""
+        else:
+            text, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        if text:
+            items.append(("text", text))
+        return items
+
+    def flush(self) -> str | None:
+        """Devuelve lo retenido al terminar el stream; una marca que nunca se cerró se descarta."""
+        remainder = self._buffer
+        self._buffer = ""
+        if self._partial_tag_start(remainder) == 0:
+            return None
+        return remainder or None
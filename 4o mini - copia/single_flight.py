@@ -0,0 +1,139 @@
+'''
+Coalescencia "single-flight" de llamadas idénticas en curso.
+Si llegan varias peticiones con la misma clave mientras la primera aún no ha terminado
+(reintentos del frontend, una misma pregunta de varios alumnos a la vez), todas esperan
+el mismo resultado en lugar de repetir la llamada a OpenAI o a edge-tts.
+Solo se comparte lo que está en curso: al terminar, la clave se libera (para reutilizar
+resultados ya terminados están las cachés).
+'''
+import os
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# --- Configuración ---
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+class _SharedStream:
+    """Un stream en curso: un único productor y tantos lectores como llamadas coalescidas."""
+    def __init__(self):
+        self.items: list[Any] = []
+        self.finished = False
+        self.error: BaseException | None = None
+        self.readers = 0
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Task | None = None
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en una sola."""
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self._streams: dict[Hashable, _SharedStream] = {}
+
+        # Métricas
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, make_call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Devuelve el resultado de make_call(), compartido con las llamadas en curso de la misma clave.
+        La llamada corre en su propia tarea: si quien la inició se cancela, las demás siguen esperándola.
+        """
+        self.calls += 1
+        if not SINGLE_FLIGHT_ENABLED:
+            return await make_call()
+
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(make_call())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def stream(self, key: Hashable, make_stream: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """
+        Versión para generadores asíncronos: cada lector recibe todos los elementos desde el
+        principio, aunque se una cuando el productor ya ha empezado. Si todos los lectores
+        se van antes del final, el productor se cancela.
+        """
+        self.calls += 1
+        if not SINGLE_FLIGHT_ENABLED:
+            async for item in make_stream():
+                yield item
+            return
+
+        shared = self._streams.get(key)
+        if shared is not None:
+            self.coalesced += 1
+        else:
+            shared = self._streams[key] = _SharedStream()
+            shared.task = asyncio.create_task(self._pump(key, shared, make_stream))
+
+        shared.readers += 1
+        position = 0
+        try:
+            while True:
+                async with shared.changed:
+                    await shared.changed.wait_for(
+                        lambda: position < len(shared.items) or shared.finished)
+                    batch = shared.items[position:]
+                    done = shared.finished
+                for item in batch:
+                    yield item
+                position += len(batch)
+                if done and position >= len(shared.items):
+                    break
+            if shared.error is not None:
+                raise shared.error
+        finally:
+            shared.readers -= 1
+            if shared.readers == 0 and not shared.finished:
+                shared.task.cancel()
+                if self._streams.get(key) is shared:
+                    del self._streams[key]
+
+    async def _pump(self, key: Hashable, shared: _SharedStream, make_stream: Callable[[], AsyncIterator[T]]):
+        try:
+            async for item in make_stream():
+                async with shared.changed:
+                    shared.items.append(item)
+                    shared.changed.notify_all()
+        except asyncio.CancelledError:
+            shared.finished = True
+            raise
+        except Exception as e:
+            shared.error = e
+        finally:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+        async with shared.changed:
+            shared.finished = True
+            shared.changed.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+_groups: dict[str, SingleFlight] = {}
+
+def get_group(name: str) -> SingleFlight:
+    """Devuelve (creándolo si hace falta) el grupo single-flight con ese nombre."""
+    group = _groups.get(name)
+    if group is None:
+        group = _groups[name] = SingleFlight(name)
+    return group
+
+def stats_all() -> dict:
+    return {name: group.stats() for name, group in sorted(_groups.items())}
@@ -1,9 +1,31 @@
 '''
-Handles lip-sync by controlling the MouthOpen parameter in VTube Studio.
+Handles lip-sync by controlling the mouth parameters in VTube Studio.
+The envelope is computed from the PCM that is actually being played and streamed
+to VTube Studio at a steady rate, locked to the playback clock of the audio engine.
 '''
+import os
+import asyncio
+
+import numpy as np
+from dotenv import load_dotenv
+
 # Import the singleton instance from our unified client
 from vtube_client import vts_client
 
+load_dotenv()
+
+# --- Configuration ---
+LIPSYNC_ENABLED = os.getenv("LIPSYNC_ENABLED", "true").lower() == "true"
+# Rate at which mouth values are sent to VTube Studio (30-60 Hz works well)
+LIPSYNC_FPS = int(os.getenv("LIPSYNC_FPS", "30"))
+# RMS (int16 scale) that corresponds to a fully open mouth
+LIPSYNC_RMS_REFERENCE = float(os.getenv("LIPSYNC_RMS_REFERENCE", "4000"))
+LIPSYNC_OPEN_PARAMETER = os.getenv("LIPSYNC_OPEN_PARAMETER", "MouthOpen")
+# VTube Studio's default input for the Live2D ParamMouthForm is MouthSmile
+LIPSYNC_FORM_PARAMETER = os.getenv("LIPSYNC_FORM_PARAMETER", "MouthSmile")
+# Below this level the mouth is considered closed (silence between words)
+NOISE_GATE = 0.05
+
 async def lip_sync(enable: bool = True):
     """
     Controls the 'MouthOpen' parameter in VTube Studio for basic lip-sync.
@@ -12,6 +34,105 @@ async def lip_sync(enable: bool = True):
     try:
         value = 1.0 if enable else 0.0
         # Use the new, specific method from the unified client
-        await vts_client.set_parameter_value("MouthOpen", value)
+        await vts_client.set_parameter_value(LIPSYNC_OPEN_PARAMETER, value)
     except Exception as e:
-        print(f"⚠️ Error al sincronizar labios: {e}")
\ No newline at end of file
+        print(f"⚠️ Error al sincronizar labios: {e}")
+
+def compute_envelope(samples: np.ndarray, sample_rate: int, fps: int = LIPSYNC_FPS) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes per-frame mouth values from int16 PCM, fully vectorized.
+    Returns (mouth_open, mouth_form), both in [0, 1], one value per 1/fps seconds.
+    - mouth_open follows the RMS energy of the frame.
+    - mouth_form uses the zero-crossing rate as a cheap viseme cue: bright sounds
+      ("i", "e", sibilants) widen the mouth, dark ones ("o", "u") round it.
+    """
+    frame_size = max(1, sample_rate // fps)
+    n_frames = int(np.ceil(len(samples) / frame_size))
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+    padded = np.zeros(n_frames * frame_size, dtype=np.float32)
+    padded[:len(samples)] = samples
+    frames = padded.reshape(n_frames, frame_size)
+
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    mouth_open = np.clip(rms / LIPSYNC_RMS_REFERENCE, 0.0, 1.0)
+    # Perceptual curve: small energies still open the mouth visibly
+    mouth_open = np.sqrt(mouth_open)
+    mouth_open[mouth_open < NOISE_GATE] = 0.0
+    # Light smoothing across neighbouring frames to avoid jitter
+    if n_frames >= 3:
+        mouth_open = np.convolve(mouth_open, np.array([0.25, 0.5, 0.25], dtype=np.float32), mode="same")
+
+    crossings = np.abs(np.diff(np.signbit(frames).astype(np.int8), axis=1))
+    zcr = crossings.mean(axis=1) if frame_size > 1 else np.zeros(n_frames, dtype=np.float32)
+    # Speech ZCR is roughly 0.02-0.25 per sample at 24 kHz; map that range to [0, 1]
+    mouth_form = np.clip((zcr - 0.02) / 0.23, 0.0, 1.0)
+    mouth_form[mouth_open == 0.0] = 0.5 # Neutral shape when the mouth is closed
+
+    return mouth_open.astype(np.float32), mouth_form.astype(np.float32)
+
+class LipSyncDriver:
+    """
+    Streams MouthOpen/MouthForm values to VTube Studio while queued clips play.
+    Clips are tracked one after another, in the same order as the playback engine plays them,
+    and the frame to send is chosen from the engine's playback position, not from wall time.
+    """
+    def __init__(self, fps: int = LIPSYNC_FPS):
+        self.fps = fps
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def track(self, handle, samples: np.ndarray, sample_rate: int):
+        """Schedules lip-sync for a clip that has been queued on the playback engine."""
+        if not LIPSYNC_ENABLED:
+            return
+        envelope = compute_envelope(samples, sample_rate, self.fps)
+        self._queue.put_nowait((handle, sample_rate, envelope))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _send(self, mouth_open: float, mouth_form: float):
+        await vts_client.set_parameter_values({
+            LIPSYNC_OPEN_PARAMETER: float(mouth_open),
+            LIPSYNC_FORM_PARAMETER: float(mouth_form),
+        })
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.fps
+        try:
+            while True:
+                try:
+                    handle, sample_rate, (mouth_open, mouth_form) = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    # Nothing else queued: close the mouth and stop until the next clip
+                    if vts_client.is_authenticated:
+                        await self._send(0.0, 0.5)
+                    if self._queue.empty():
+                        return
+                    continue
+
+                if not vts_client.is_authenticated or len(mouth_open) == 0:
+                    continue
+
+                # Wait for the engine to start playing this clip
+                while not handle.started and not handle.done():
+                    await asyncio.sleep(period / 2)
+
+                next_tick = loop.time()
+                while not handle.done():
+                    # If VTS drops mid-clip, skip frames (keeping the schedule) until it is back
+                    if vts_client.is_authenticated:
+                        frame = min(int(handle.position_frames * self.fps / sample_rate), len(mouth_open) - 1)
+                        await self._send(mouth_open[frame], mouth_form[frame])
+                    # Fixed-rate schedule that does not drift with send latency
+                    next_tick += period
+                    await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Error al sincronizar labios: {e}")
+
+# Singleton instance shared by all playback paths
+lip_sync_driver = LipSyncDriver()
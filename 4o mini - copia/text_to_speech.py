@@ -1,13 +1,21 @@
 import io
+import asyncio
+import shutil
+import subprocess
+from typing import AsyncIterator
 import numpy as np
 import sounddevice as sd
 import base64
 import edge_tts
-from pydub import AudioSegment
 
 from config import TTS_VOICE, AUDIO_OUTPUT_DEVICE
-from speech_sync import lip_sync
+from speech_sync import lip_sync_driver
 from utils import find_audio_device_id # Import the new function
+from audio_playback import PlaybackHandle, get_playback_engine
+from tts_cache import tts_cache
+from audio_decode import decode_mp3
+from single_flight import get_group
+from metrics import timed, traced
 
 def list_audio_devices():
     """Lists available audio output devices."""
@@ -29,26 +37,194 @@ def get_default_device_id():
 # Find the device ID once when the module is loaded
 output_device_id = find_audio_device_id(AUDIO_OUTPUT_DEVICE)
 
+# edge-tts default output format; part of the TTS cache key
+TTS_OUTPUT_FORMAT = "audio-24khz-48kbitrate-mono-mp3"
+TTS_SAMPLE_RATE = 24000
+# How many PCM bytes to read from the streaming decoder at a time
+PCM_READ_BYTES = 4096
+# Progressive local playback needs ffmpeg; without it the chunks are only sent to the client
+FFMPEG_PATH = shutil.which("ffmpeg")
+
+# Concurrent requests for the same sentence share one edge-tts synthesis
+speech_flights = get_group("tts")
+speech_stream_flights = get_group("tts_stream")
+
+class SpeechClip:
+    """A synthesized sentence: the original MP3 plus its decoded PCM samples."""
+    def __init__(self, mp3_bytes: bytes, samples: np.ndarray, sample_rate: int):
+        self.mp3_bytes = mp3_bytes
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    def to_base64(self) -> str:
+        """Encodes the MP3 as Base64 for the frontend."""
+        return base64.b64encode(self.mp3_bytes).decode('utf-8')
+
+@traced("tts_synthesize")
+async def fetch_speech_mp3(text: str) -> bytes:
+    """
+    Returns the MP3 for a text, from the TTS cache when possible.
+    On a miss it is generated with edge-tts and stored in the cache.
+    """
+    return await speech_flights.do((TTS_VOICE, TTS_OUTPUT_FORMAT, text), lambda: _fetch_speech_mp3(text))
+
+async def _fetch_speech_mp3(text: str) -> bytes:
+    mp3_bytes = await tts_cache.get(TTS_VOICE, text, TTS_OUTPUT_FORMAT)
+    if mp3_bytes is not None:
+        return mp3_bytes
+
+    tts = edge_tts.Communicate(text, TTS_VOICE)
+    audio_bytes = io.BytesIO()
+    # Collect all audio chunks into a single BytesIO object
+    async for chunk in tts.stream():
+        if chunk["type"] == "audio":
+            audio_bytes.write(chunk["data"])
+
+    mp3_bytes = audio_bytes.getvalue()
+    await tts_cache.put(TTS_VOICE, text, TTS_OUTPUT_FORMAT, mp3_bytes)
+    return mp3_bytes
+
+async def synthesize_speech(text: str) -> SpeechClip | None:
+    """
+    Generates the audio for a text with edge-tts (or the cache) and decodes it, without playing it.
+    Safe to run concurrently for several sentences.
+    """
+    try:
+        mp3_bytes = await fetch_speech_mp3(text)
+        return await decode_speech(mp3_bytes)
+
+    except Exception as e:
+        print(f"⚠️ Error al sintetizar audio: {e}")
+        return None
+
+@traced("tts_decode")
+async def decode_speech(mp3_bytes: bytes) -> SpeechClip:
+    """Decodes already synthesized MP3 audio into a playable clip."""
+    # Decoding is CPU-bound; keep it off the event loop
+    audio_data, sample_rate = await asyncio.to_thread(decode_mp3, mp3_bytes)
+    return SpeechClip(mp3_bytes, audio_data, sample_rate)
+
+async def play_for_lipsync(clip: SpeechClip, device_id: int | None) -> PlaybackHandle:
+    """
+    Queues a clip on the selected device's persistent stream for lip-sync.
+    Returns as soon as it is queued; queued clips play back to back without gaps.
+    """
+    engine = get_playback_engine(device_id, clip.sample_rate)
+    with timed("audio_enqueue"): # Only waits when the device's buffer is full
+        handle = await engine.enqueue(clip.samples)
+    # Mouth movement follows the playback clock of this clip
+    lip_sync_driver.track(handle, clip.samples, clip.sample_rate)
+    return handle
+
+async def stream_speech(text: str) -> AsyncIterator[bytes]:
+    """
+    Yields the MP3 chunks of a text as edge-tts produces them.
+    A cached text is yielded as a single chunk; a complete new one is added to the cache.
+    """
+    async for chunk in speech_stream_flights.stream((TTS_VOICE, TTS_OUTPUT_FORMAT, text),
+                                                    lambda: _stream_speech(text)):
+        yield chunk
+
+async def _stream_speech(text: str) -> AsyncIterator[bytes]:
+    cached = await tts_cache.get(TTS_VOICE, text, TTS_OUTPUT_FORMAT)
+    if cached is not None:
+        yield cached
+        return
+
+    tts = edge_tts.Communicate(text, TTS_VOICE)
+    collected = bytearray()
+    async for chunk in tts.stream():
+        if chunk["type"] == "audio":
+            collected.extend(chunk["data"])
+            yield chunk["data"]
+    await tts_cache.put(TTS_VOICE, text, TTS_OUTPUT_FORMAT, bytes(collected))
+
+class ProgressivePlayer:
+    """
+    Plays an MP3 stream while it is still arriving: the chunks are piped through
+    an ffmpeg decoder and the PCM is queued on the device's playback engine as it comes out.
+    """
+    def __init__(self, device_id: int | None):
+        self.device_id = device_id
+        self.first_handle: PlaybackHandle | None = None
+        self.last_handle: PlaybackHandle | None = None
+        self._engine = get_playback_engine(device_id, TTS_SAMPLE_RATE)
+        self._process = subprocess.Popen(
+            [FFMPEG_PATH or "ffmpeg", "-hide_banner", "-loglevel", "error",
+             "-f", "mp3", "-i", "pipe:0",
+             "-f", "s16le", "-ac", "1", "-ar", str(TTS_SAMPLE_RATE), "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0,
+        )
+        self._reader = asyncio.create_task(self._pump_pcm())
+
+    async def _pump_pcm(self):
+        """Moves decoded PCM from ffmpeg's stdout to the playback engine."""
+        pending = b""
+        while True:
+            data = await asyncio.to_thread(self._process.stdout.read, PCM_READ_BYTES)
+            if not data:
+                break
+            pending += data
+            usable = len(pending) - len(pending) % 2 # Whole int16 samples only
+            if usable:
+                samples = np.frombuffer(pending[:usable], dtype=np.int16)
+                self.last_handle = await self._engine.enqueue(samples)
+                if self.first_handle is None:
+                    self.first_handle = self.last_handle
+                lip_sync_driver.track(self.last_handle, samples, TTS_SAMPLE_RATE)
+                pending = pending[usable:]
+
+    async def feed(self, mp3_chunk: bytes):
+        """Sends an MP3 chunk to the decoder."""
+        await asyncio.to_thread(self._process.stdin.write, mp3_chunk)
+
+    async def finish(self) -> PlaybackHandle | None:
+        """Closes the input and waits until all the decoded audio has been queued."""
+        try:
+            self._process.stdin.close()
+            await self._reader
+        finally:
+            await asyncio.to_thread(self._process.wait)
+        return self.last_handle
+
+    def abort(self):
+        """Stops decoding (for example, if the client disconnected)."""
+        self._reader.cancel()
+        self._process.kill()
+        self._process.wait() # Reap it so no zombie is left behind
+
+_ffmpeg_warning_shown = False
+
+def start_progressive_player(device_id: int | None) -> ProgressivePlayer | None:
+    """
+    Starts a ProgressivePlayer, or returns None if local playback is not possible
+    (ffmpeg missing or failing to start). The caller still forwards the audio to the client.
+    """
+    global _ffmpeg_warning_shown
+    if FFMPEG_PATH is None:
+        if not _ffmpeg_warning_shown:
+            print("⚠️ ffmpeg no está instalado: el audio en streaming no se reproducirá localmente.")
+            _ffmpeg_warning_shown = True
+        return None
+    try:
+        return ProgressivePlayer(device_id)
+    except Exception as e:
+        print(f"⚠️ No se pudo iniciar la reproducción progresiva: {e}")
+        return None
+
 async def text_to_speech(text):
     try:
         print(f"🔊 Generando audio para: '{text}'")
-        tts = edge_tts.Communicate(text, TTS_VOICE)
-        audio_bytes = io.BytesIO()
-        async for chunk in tts.stream():
-            if chunk["type"] == "audio":
-                audio_bytes.write(chunk["data"])
-        audio_bytes.seek(0)
-        
-        audio_segment = AudioSegment.from_file(audio_bytes, format="mp3")
-        audio_data = np.array(audio_segment.get_array_of_samples(), dtype=np.int16)
+        clip = await synthesize_speech(text)
+        if not clip:
+            return
         
         device_info = f"el dispositivo por defecto" if AUDIO_OUTPUT_DEVICE is None else f"'{AUDIO_OUTPUT_DEVICE}'"
         print(f"▶️  Reproduciendo audio en {device_info}...")
         
-        # await lip_sync(True) # Comentado temporalmente
-        sd.play(audio_data, samplerate=audio_segment.frame_rate, device=output_device_id) # Use the resolved ID
-        sd.wait()
-        # await lip_sync(False) # Comentado temporalmente
+        # Lip-sync is driven from the decoded audio while it plays
+        handle = await play_for_lipsync(clip, output_device_id) # Use the resolved ID
+        await handle.wait()
         print("✅ Audio reproducido.")
 
     except Exception as e:
@@ -60,27 +236,16 @@ async def get_speech_and_play_for_lipsync(text: str, device_id: int | None) -> s
     and returns it as a Base64 string for the frontend.
     """
     try:
-        tts = edge_tts.Communicate(text, TTS_VOICE)
-        audio_bytes = io.BytesIO()
-        # Collect all audio chunks into a single BytesIO object
-        async for chunk in tts.stream():
-            if chunk["type"] == "audio":
-                audio_bytes.write(chunk["data"])
-        
-        audio_bytes.seek(0)
-        
+        clip = await synthesize_speech(text)
+        if not clip:
+            return None
+
         # For playback on the backend (for lip-sync via virtual cable)
-        audio_segment = AudioSegment.from_file(audio_bytes, format="mp3")
-        audio_data = np.array(audio_segment.get_array_of_samples(), dtype=np.int16)
-        
-        # Play audio on the selected device. This is non-blocking.
-        sd.play(audio_data, samplerate=audio_segment.frame_rate, device=device_id)
+        await play_for_lipsync(clip, device_id)
 
         # For sending to the frontend
-        audio_bytes.seek(0) # Reset pointer to the beginning
-        base64_audio = base64.b64encode(audio_bytes.read()).decode('utf-8')
-        return base64_audio
+        return clip.to_base64()
 
     except Exception as e:
         print(f"⚠️ Error en get_speech_and_play_for_lipsync: {e}")
-        return None
\ No newline at end of file
+        return None
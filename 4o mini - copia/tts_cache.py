@@ -0,0 +1,153 @@
+'''
+Caché de audio TTS direccionada por contenido.
+Clave: hash de (voz, texto, formato). Un LRU en memoria con límite de bytes,
+respaldado por un almacén en disco que sobrevive a los reinicios.
+'''
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuración ---
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(os.path.dirname(__file__), "tts_cache"))
+# Cada cuántas escrituras se revisa el tamaño del directorio de caché.
+PRUNE_EVERY_WRITES = 50
+
+class TTSCache:
+    """LRU en memoria con límite de bytes + almacén en disco."""
+    def __init__(self, max_memory_bytes: int = TTS_CACHE_MEMORY_BYTES,
+                 disk_dir: str | None = TTS_CACHE_DIR, max_disk_bytes: int = TTS_CACHE_DISK_BYTES):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+
+        # Métricas
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(voice: str, text: str, audio_format: str) -> str:
+        """Hash estable del contenido que determina el audio."""
+        payload = "\x1f".join((voice, audio_format, text.strip()))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _remember(self, key: str, data: bytes):
+        """Inserta en el LRU de memoria y expulsa lo menos usado si se supera el límite."""
+        if len(data) > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key: str) -> bytes | None:
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes):
+        # Escritura atómica: nunca se lee un archivo a medio escribir.
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _prune_disk(self):
+        """Borra los archivos más antiguos si el directorio supera el límite de bytes."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith(".bin"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_disk_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    async def get(self, voice: str, text: str, audio_format: str) -> bytes | None:
+        """Busca el audio primero en memoria y luego en disco."""
+        key = self.make_key(voice, text, audio_format)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+
+        if self.disk_dir:
+            data = await asyncio.to_thread(self._read_disk, key)
+            if data is not None:
+                self.disk_hits += 1
+                self._remember(key, data)
+                return data
+
+        self.misses += 1
+        return None
+
+    async def put(self, voice: str, text: str, audio_format: str, data: bytes):
+        """Guarda el audio en memoria y en disco."""
+        if not data:
+            return
+        key = self.make_key(voice, text, audio_format)
+        self._remember(key, data)
+        if not self.disk_dir:
+            return
+        try:
+            await asyncio.to_thread(self._write_disk, key, data)
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= PRUNE_EVERY_WRITES:
+                self._writes_since_prune = 0
+                await asyncio.to_thread(self._prune_disk)
+        except OSError as e:
+            print(f"⚠️ Error al guardar audio en la caché de disco: {e}")
+
+    def stats(self) -> dict:
+        """Métricas de aciertos de la caché."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+        }
+
+# Instancia compartida por todo el proceso
+tts_cache = TTSCache()
@@ -0,0 +1,105 @@
+'''
+Etapa de pipeline que sintetiza las próximas oraciones por adelantado
+con un límite de concurrencia, entregando los resultados en el orden original.
+'''
+import os
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuración ---
+# Número máximo de oraciones sintetizándose a la vez (peticiones a edge-tts + decodificación).
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", "3"))
+
+class TTSPipeline:
+    """
+    Recibe oraciones con submit() y las sintetiza en segundo plano.
+    results() devuelve los audios en el mismo orden en que se enviaron las oraciones,
+    aunque terminen de sintetizarse en otro orden. Cada oración puede llevar la expresión
+    que debe activarse cuando empiece a sonar.
+    """
+    def __init__(self, synthesize: Callable[[str], Awaitable[Any]], max_concurrency: int = TTS_MAX_CONCURRENCY):
+        self._synthesize = synthesize
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._closed = False
+
+    async def _run(self, sentence: str):
+        async with self._semaphore:
+            return await self._synthesize(sentence)
+
+    def submit(self, sentence: str, expression: str | None = None):
+        """Encola una oración y empieza a sintetizarla en cuanto haya un hueco libre."""
+        if self._closed:
+            raise RuntimeError("No se pueden enviar oraciones a un pipeline cerrado.")
+        task = asyncio.create_task(self._run(sentence))
+        self._tasks.append(task)
+        self._pending.put_nowait((sentence, task, expression))
+
+    def close(self):
+        """Indica que no llegarán más oraciones."""
+        if not self._closed:
+            self._closed = True
+            self._pending.put_nowait(None)
+
+    async def results(self) -> AsyncIterator[tuple[str, Any, str | None]]:
+        """Produce (oración, resultado, expresión) en orden de envío hasta que se cierre el pipeline."""
+        while True:
+            item = await self._pending.get()
+            if item is None:
+                return
+            sentence, task, expression = item
+            try:
+                result = await task
+            except Exception as e:
+                print(f"⚠️ Error en la síntesis de '{sentence}': {e}")
+                result = None
+            yield sentence, result, expression
+
+    def cancel(self):
+        """Cancela las síntesis pendientes (por ejemplo, si el cliente se desconecta)."""
+        self.close()
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+
+class StreamingTTSPipeline(TTSPipeline):
+    """
+    Variante en la que `synthesize` devuelve un iterador asíncrono de fragmentos de audio.
+    results() entrega, en orden, cada oración junto con un iterador que va recibiendo
+    sus fragmentos en vivo; las oraciones siguientes se acumulan por adelantado.
+    """
+    async def _pump(self, sentence: str, chunks: asyncio.Queue):
+        try:
+            async with self._semaphore:
+                async for chunk in self._synthesize(sentence):
+                    chunks.put_nowait(chunk)
+        except Exception as e:
+            print(f"⚠️ Error en la síntesis de '{sentence}': {e}")
+        finally:
+            chunks.put_nowait(None)
+
+    def submit(self, sentence: str, expression: str | None = None):
+        if self._closed:
+            raise RuntimeError("No se pueden enviar oraciones a un pipeline cerrado.")
+        chunks: asyncio.Queue = asyncio.Queue()
+        self._tasks.append(asyncio.create_task(self._pump(sentence, chunks)))
+        self._pending.put_nowait((sentence, chunks, expression))
+
+    @staticmethod
+    async def _drain(chunks: asyncio.Queue) -> AsyncIterator[Any]:
+        while (chunk := await chunks.get()) is not None:
+            yield chunk
+
+    async def results(self) -> AsyncIterator[tuple[str, AsyncIterator[Any], str | None]]:
+        """Produce (oración, fragmentos, expresión) en orden de envío hasta que se cierre el pipeline."""
+        while True:
+            item = await self._pending.get()
+            if item is None:
+                return
+            sentence, chunks, expression = item
+            yield sentence, self._drain(chunks), expression
@@ -0,0 +1,399 @@
+'''
+Almacenes vectoriales para la memoria semántica, detrás de una interfaz asíncrona común.
+
+- ChromaVectorStore: la colección de ChromaDB de siempre.
+- MemmapVectorStore: matriz de embeddings en un archivo mapeado en memoria (float32 o
+  float16) con un sidecar JSONL de ids/documentos/metadatos. El top-k es un producto
+  matricial por bloques más argpartition; abrirlo no carga la matriz en RAM.
+  Opcionalmente guarda además una copia int8 (cuantización escalar por fila): la búsqueda
+  recorre la copia int8 y solo los mejores candidatos se re-puntúan con los floats.
+
+Las operaciones son síncronas (E/S de disco, HNSW, numpy) y se ejecutan en un pool de
+hilos compartido por todos los almacenes, para no bloquear el event loop de FastAPI.
+Ambos backends devuelven los resultados de query con la misma forma que ChromaDB
+(listas por consulta).
+
+Cada almacén puede ser un "shard": la memoria de un usuario vive en su propia colección
+(o directorio), así que buscar solo recorre los datos de ese usuario.
+'''
+import os
+import json
+import time
+import hashlib
+import asyncio
+import functools
+import threading
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from metrics import get_histogram, record
+
+load_dotenv()
+
+# --- Configuración ---
+# Hilos dedicados al almacén vectorial. 0 = llamadas en línea (bloquean el loop; útil para comparar).
+VECTOR_STORE_WORKERS = int(os.getenv("VECTOR_STORE_WORKERS", "2"))
+# "chroma" o "memmap"
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
+MEMMAP_DIR = os.getenv("MEMMAP_DIR", os.path.join(os.path.dirname(__file__), "memory_vectors"))
+MEMMAP_DTYPE = os.getenv("MEMMAP_DTYPE", "float32")
+# Filas por bloque al calcular similitudes (acota la memoria temporal con float16)
+MEMMAP_QUERY_BLOCK = int(os.getenv("MEMMAP_QUERY_BLOCK", "8192"))
+
+_executor: ThreadPoolExecutor | None = None
+
+def get_executor() -> ThreadPoolExecutor | None:
+    """Pool de hilos compartido por los almacenes (None si VECTOR_STORE_WORKERS=0)."""
+    global _executor
+    if _executor is None and VECTOR_STORE_WORKERS > 0:
+        _executor = ThreadPoolExecutor(max_workers=VECTOR_STORE_WORKERS, thread_name_prefix="vector-store")
+    return _executor
+
+def close_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+def shard_suffix(user_id: str) -> str:
+    """Nombre estable y válido para colecciones/directorios a partir de un user_id arbitrario."""
+    return "u_" + hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:16]
+
+async def run_blocking(fn, *args, **kwargs):
+    """Ejecuta una función bloqueante en el pool del almacén vectorial."""
+    call = functools.partial(fn, *args, **kwargs)
+    executor = get_executor()
+    if executor is None:
+        return call()
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+class VectorStore:
+    """
+    Interfaz común. Las subclases implementan las versiones síncronas (_add, _query,
+    _count, _clear); aquí se ejecutan en el pool de hilos y se mide su latencia.
+    """
+    backend = "base"
+
+    async def _call(self, operation: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await run_blocking(fn, *args, **kwargs)
+        finally:
+            record(f"vector_store_{operation}", start)
+
+    async def add(self, ids: list[str], embeddings: list, metadatas: list[dict], documents: list[str]):
+        return await self._call("add", self._add, ids=ids, embeddings=embeddings,
+                                metadatas=metadatas, documents=documents)
+
+    async def query(self, query_embeddings: list, n_results: int = 3,
+                    include: list[str] = ("metadatas", "documents", "distances")) -> dict:
+        return await self._call("query", self._query, query_embeddings=query_embeddings,
+                                n_results=n_results, include=list(include))
+
+    async def count(self) -> int:
+        return await self._call("count", self._count)
+
+    async def clear(self):
+        """Borra todas las memorias del almacén."""
+        return await self._call("clear", self._clear)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "workers": VECTOR_STORE_WORKERS,
+            "add": get_histogram("vector_store_add").snapshot(),
+            "query": get_histogram("vector_store_query").snapshot(),
+        }
+
+    def close(self):
+        """Libera los recursos del almacén (el pool de hilos es compartido)."""
+
+class ChromaVectorStore(VectorStore):
+    """Colección persistente de ChromaDB."""
+    backend = "chroma"
+
+    _clients: dict = {}
+
+    def __init__(self, path: str, collection_name: str):
+        self.collection_name = collection_name
+        self.db_client = self.client(path)
+        self.collection = self.db_client.get_or_create_collection(name=collection_name)
+
+    @classmethod
+    def client(cls, path: str):
+        """Un cliente por ruta, compartido por todos los shards."""
+        if path not in cls._clients:
+            import chromadb
+            cls._clients[path] = chromadb.PersistentClient(path=path)
+        return cls._clients[path]
+
+    @staticmethod
+    def _as_lists(embeddings):
+        # Los embeddings llegan como arrays de numpy (caché) o listas; chromadb espera listas
+        return [np.asarray(embedding, dtype=np.float32).tolist() for embedding in embeddings]
+
+    def _add(self, embeddings, **kwargs):
+        self.collection.add(embeddings=self._as_lists(embeddings), **kwargs)
+
+    def _query(self, query_embeddings, **kwargs):
+        return self.collection.query(query_embeddings=self._as_lists(query_embeddings), **kwargs)
+
+    def _count(self):
+        return self.collection.count()
+
+    def _clear(self):
+        self.db_client.delete_collection(name=self.collection_name)
+        self.collection = self.db_client.get_or_create_collection(name=self.collection_name)
+
+class _MemmapView(NamedTuple):
+    """Instantánea de un MemmapVectorStore para una consulta."""
+    size: int
+    vectors: np.ndarray
+    norms: np.ndarray
+    ids: list[str]
+    documents: list[str]
+    metadatas: list[dict]
+
+class MemmapVectorStore(VectorStore):
+    """
+    Embeddings en <dir>/vectors.bin (matriz capacidad x dim), sus normas al cuadrado en
+    <dir>/norms.bin, y en <dir>/records.jsonl una línea por fila con id, documento y metadatos.
+    Sin cuantización int8: con numpy, pasar los códigos a float para multiplicarlos (o multiplicar
+    en enteros, sin BLAS) es más lento que el producto en float32. Los codes.bin/scales.bin de
+    versiones anteriores se ignoran; los vectores float siguen al lado.
+    <dir>/header.json guarda dim, dtype y cuántas filas son válidas; se reescribe al final
+    de cada inserción, así que una escritura interrumpida no deja filas a medias visibles.
+    Las distancias son L2 al cuadrado, como en la colección de ChromaDB por defecto.
+    Las llamadas llegan desde varios hilos del executor: las escrituras (inserción, borrado,
+    crecimiento y cabecera) van bajo un lock, y cada consulta trabaja sobre una instantánea
+    de los mapas y del tamaño tomada bajo ese mismo lock.
+    """
+    backend = "memmap"
+
+    def __init__(self, directory: str = MEMMAP_DIR, dtype: str = MEMMAP_DTYPE):
+        self.directory = directory
+        # El de un directorio existente lo fija su cabecera; tras clear() vuelve a ser este
+        self._configured_dtype = np.dtype(dtype)
+        self.dtype = self._configured_dtype
+        self.dim = None
+        self.size = 0
+        self.capacity = 0
+        self.vectors = None
+        self.norms = None
+        self.ids: list[str] = []
+        self.documents: list[str] = []
+        self.metadatas: list[dict] = []
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        if not os.path.exists(self._path("header.json")):
+            return
+        with open(self._path("header.json"), encoding="utf-8") as f:
+            header = json.load(f)
+        self.dim = header["dim"]
+        self.dtype = np.dtype(header["dtype"])
+        self.size = header["size"]
+        self.capacity = header["capacity"]
+        self._map()
+        # Solo cuentan las `size` primeras líneas del sidecar. Lo que haya detrás viene de una
+        # inserción que no llegó a la cabecera: se recorta para que la siguiente no quede desfasada.
+        records_path = self._path("records.jsonl")
+        valid_bytes = 0
+        if os.path.exists(records_path):
+            with open(records_path, "rb") as f:
+                for line, _ in zip(f, range(self.size)):
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line)
+                    self.ids.append(record["id"])
+                    self.documents.append(record["document"])
+                    self.metadatas.append(record["metadata"])
+                    valid_bytes += len(line)
+            if os.path.getsize(records_path) > valid_bytes:
+                with open(records_path, "r+b") as f:
+                    f.truncate(valid_bytes)
+        if len(self.ids) < self.size:
+            print(f"⚠️ {records_path} tiene {len(self.ids)} registros de {self.size}; se ignoran las filas sin registro.")
+            self.size = len(self.ids)
+
+    def _map(self):
+        self.vectors = np.memmap(self._path("vectors.bin"), dtype=self.dtype, mode="r+",
+                                 shape=(self.capacity, self.dim))
+        self.norms = np.memmap(self._path("norms.bin"), dtype=np.float32, mode="r+",
+                               shape=(self.capacity,))
+
+    def _grow(self, needed: int):
+        """Amplía los archivos (duplicando la capacidad) y vuelve a mapearlos. Requiere el lock."""
+        capacity = max(needed, self.capacity * 2, 1024)
+        files = [("vectors.bin", self.dim * self.dtype.itemsize), ("norms.bin", 4)]
+        for name, row_bytes in files:
+            with open(self._path(name), "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self.vectors = self.norms = None
+        self.capacity = capacity
+        self._map()
+
+    def _write_header(self):
+        """Requiere el lock: el archivo temporal es único por almacén."""
+        header = {"dim": self.dim, "dtype": self.dtype.name, "size": self.size,
+                  "capacity": self.capacity}
+        tmp_path = self._path("header.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self._path("header.json"))
+
+    def _add(self, ids, embeddings, metadatas, documents):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            self._add_locked(ids, matrix, metadatas, documents)
+
+    def _add_locked(self, ids, matrix, metadatas, documents):
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"Dimensión {matrix.shape[1]} distinta de la del almacén ({self.dim}).")
+
+        start, end = self.size, self.size + len(matrix)
+        if end > self.capacity:
+            self._grow(end)
+        stored = matrix.astype(self.dtype)
+        self.vectors[start:end] = stored
+        # Normas de los valores tal como quedan guardados (float16 redondea)
+        stored = stored.astype(np.float32)
+        self.norms[start:end] = np.einsum("ij,ij->i", stored, stored)
+        self.vectors.flush()
+        self.norms.flush()
+
+        # Si la cabecera no llega a escribirse, estas líneas se recortan al cargar (size manda)
+        with open(self._path("records.jsonl"), "a", encoding="utf-8") as f:
+            for memory_id, document, metadata in zip(ids, documents, metadatas):
+                f.write(json.dumps({"id": memory_id, "document": document, "metadata": metadata},
+                                   ensure_ascii=False) + "\n")
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+        self.size = end
+        self._write_header()
+
+    def _snapshot(self) -> "_MemmapView":
+        """
+        Lo que necesita una consulta, leído bajo el lock. Las filas ya escritas no cambian
+        después y los archivos solo crecen, así que los mapas antiguos siguen siendo válidos
+        aunque otra inserción los sustituya mientras tanto.
+        """
+        with self._lock:
+            return _MemmapView(self.size, self.vectors, self.norms, self.ids, self.documents, self.metadatas)
+
+    @staticmethod
+    def _scores(view: "_MemmapView", queries: np.ndarray) -> np.ndarray:
+        """
+        Distancias L2 al cuadrado (consultas x filas), calculadas por bloques.
+        """
+        distances = np.empty((len(queries), view.size), dtype=np.float32)
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        for start in range(0, view.size, MEMMAP_QUERY_BLOCK):
+            end = min(start + MEMMAP_QUERY_BLOCK, view.size)
+            block = np.asarray(view.vectors[start:end], dtype=np.float32)
+            dots = queries @ block.T
+            distances[:, start:end] = query_norms + view.norms[start:end] - 2.0 * dots
+        return np.maximum(distances, 0.0, out=distances)
+
+    @staticmethod
+    def _top_k(row: np.ndarray, k: int) -> np.ndarray:
+        """Índices de las k menores distancias, ordenados."""
+        top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+        return top[np.argsort(row[top])]
+
+    def _query(self, query_embeddings, n_results, include):
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        view = self._snapshot()
+        result = {"ids": [], "distances": [], "documents": [], "metadatas": []}
+        k = min(n_results, view.size)
+        if k == 0:
+            for _ in queries:
+                for key in result:
+                    result[key].append([])
+            return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+        distances = self._scores(view, queries)
+        for row in distances:
+            top = self._top_k(row, k)
+            top_distances = row[top]
+            result["ids"].append([view.ids[i] for i in top])
+            result["distances"].append([float(d) for d in top_distances])
+            result["documents"].append([view.documents[i] for i in top])
+            result["metadatas"].append([view.metadatas[i] for i in top])
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+    def _count(self):
+        return self.size
+
+    def stats(self) -> dict:
+        return {**super().stats(), "dtype": self.dtype.name,
+                "size": self.size, "dim": self.dim}
+
+    def _clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def close(self):
+        """Suelta los mapas; las consultas en curso conservan los de su instantánea."""
+        with self._lock:
+            self.vectors = self.norms = None
+
+    def _clear_locked(self):
+        self.vectors = self.norms = None
+        for name in ("header.json", "vectors.bin", "norms.bin", "codes.bin", "scales.bin", "records.jsonl"):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.dim = None
+        self.dtype = self._configured_dtype
+        self.size = self.capacity = 0
+        self.ids, self.documents, self.metadatas = [], [], []
+
+def existing_shards(chroma_path: str, collection_name: str, backend: str = VECTOR_STORE_BACKEND,
+                    memmap_dir: str = MEMMAP_DIR) -> list[str]:
+    """Sufijos (ver shard_suffix) de los shards de usuario que ya existen en disco. Bloqueante."""
+    if backend == "memmap":
+        users_dir = os.path.join(memmap_dir, "users")
+        return sorted(os.listdir(users_dir)) if os.path.isdir(users_dir) else []
+    prefix = f"{collection_name}_u_"
+    # Según la versión, chromadb devuelve nombres u objetos Collection
+    names = [c if isinstance(c, str) else c.name for c in ChromaVectorStore.client(chroma_path).list_collections()]
+    return sorted(name[len(collection_name) + 1:] for name in names if name.startswith(prefix))
+
+def shard_exists(chroma_path: str, collection_name: str, shard: str,
+                 backend: str = VECTOR_STORE_BACKEND) -> bool:
+    """Si el shard del usuario ya existe en disco (sin crearlo). Bloqueante."""
+    if backend == "memmap":
+        return os.path.isdir(os.path.join(MEMMAP_DIR, "users", shard_suffix(shard)))
+    try:
+        ChromaVectorStore.client(chroma_path).get_collection(name=f"{collection_name}_{shard_suffix(shard)}")
+        return True
+    except Exception:
+        # Según la versión, chromadb lanza ValueError o NotFoundError
+        return False
+
+def create_vector_store(chroma_path: str, collection_name: str, shard: str | None = None,
+                        backend: str = VECTOR_STORE_BACKEND) -> VectorStore:
+    """
+    Crea el almacén configurado en VECTOR_STORE_BACKEND. Con `shard` (un user_id) se abre
+    la colección o el directorio propio de ese usuario. Es bloqueante: desde código async
+    conviene llamarla con run_blocking.
+    """
+    if backend == "memmap":
+        directory = MEMMAP_DIR if shard is None else os.path.join(MEMMAP_DIR, "users", shard_suffix(shard))
+        return MemmapVectorStore(directory)
+    if backend != "chroma":
+        print(f"⚠️ Backend vectorial desconocido '{backend}'. Se usará ChromaDB.")
+    if shard is not None:
+        collection_name = f"{collection_name}_{shard_suffix(shard)}"
+    return ChromaVectorStore(chroma_path, collection_name)
@@ -4,9 +4,12 @@
 import websockets
 import json
 import os
+import time
 import asyncio
 from dotenv import load_dotenv, set_key
 
+from metrics import record, traced
+
 # --- Configuration ---
 VTS_API_URL = "ws://localhost:8001"
 ENV_FILE = os.path.join(os.path.dirname(__file__), '.env')
@@ -26,6 +29,7 @@ class VTubeStudioClient:
         self.request_counter = 0
         self._lock = asyncio.Lock()
         self._authenticated_event = asyncio.Event()
+        self._reader_task = None
 
     def is_connected(self) -> bool:
         """Checks if the WebSocket is connected in a safe way."""
@@ -37,6 +41,8 @@ class VTubeStudioClient:
             return self.ws.open
         if hasattr(self.ws, "closed"): # For older versions
             return not self.ws.closed
+        if hasattr(self.ws, "state"): # websockets >= 14 (new asyncio implementation)
+            return self.ws.state.name == "OPEN"
         return False # Fallback if no known state attribute is found
 
     async def connect(self):
@@ -49,6 +55,8 @@ class VTubeStudioClient:
                     self.ws = await websockets.connect(self.url)
                     print("🔌 WebSocket conectado a VTube Studio.")
                     await self.authenticate()
+                    if self.is_authenticated:
+                        self._reader_task = asyncio.create_task(self._drain_responses(self.ws))
                 except (websockets.exceptions.ConnectionClosedError, ConnectionRefusedError) as e:
                     print(f"⚠️ Error al conectar con VTube Studio: {e}. ¿Está en ejecución?")
                     self.ws = None
@@ -56,6 +64,19 @@ class VTubeStudioClient:
                     print(f"⚠️ Error inesperado al conectar: {e}")
                     self.ws = None
 
+    async def _drain_responses(self, ws):
+        """
+        Reads and discards the responses to fire-and-forget requests.
+        Without this, unread responses pile up and eventually stall the connection.
+        """
+        try:
+            async for message in ws:
+                response = json.loads(message)
+                if response.get("messageType") == "APIError":
+                    print(f"⚠️ Error de la API de VTube Studio: {response.get('data', {}).get('message')}")
+        except Exception:
+            pass # The connection closed; send_request will reconnect
+
     async def _get_token_from_file(self):
         """Reads the token from the .env file."""
         load_dotenv(ENV_FILE) # Reload to get the latest value
@@ -146,16 +167,26 @@ class VTubeStudioClient:
             self.is_authenticated = False
             print(f"⚠️ Error durante la autenticación: {e}")
 
+    @traced("vts_send_request")
     async def send_request(self, request_type, data=None):
         '''Sends a generic request to the VTube Studio API.'''
-        await self.connect()
+        return await self._send(request_type, data)
+
+    async def _send(self, request_type, data=None, reconnect: bool = True):
+        '''
+        Untimed body of send_request, shared with the lip-sync parameter injection.
+        With reconnect=False the request never waits: it is dropped unless there is an authenticated connection.
+        '''
+        if reconnect:
+            await self.connect()
 
-        # If not authenticated, wait for the authentication to complete from another task.
-        if not self.is_authenticated:
-            await self._authenticated_event.wait()
+            # If not authenticated, wait for the authentication to complete from another task.
+            if not self.is_authenticated:
+                await self._authenticated_event.wait()
 
         if not self.is_authenticated or not self.is_connected(): # Double-check after waiting
-            print(f"⚠️ No se puede enviar la solicitud '{request_type}'. No hay conexión autenticada.")
+            if reconnect:
+                print(f"⚠️ No se puede enviar la solicitud '{request_type}'. No hay conexión autenticada.")
             return None
 
         try:
@@ -203,7 +234,34 @@ class VTubeStudioClient:
             data={"expressionFile": expression_file, "active": False}
         )
 
+    async def set_parameter_values(self, values: dict[str, float], face_found: bool = False):
+        '''
+        Injects values for one or more input parameters (e.g. MouthOpen, MouthSmile).
+        VTube Studio keeps injected values for about one second, so they must be re-sent continuously.
+        Timed under its own metric and kept out of turn traces: lip-sync sends ~30 of these per second.
+        Never reconnects or waits for authentication, so a dropped VTS connection cannot stall the caller.
+        '''
+        start = time.perf_counter()
+        result = await self._send(
+            "InjectParameterDataRequest",
+            data={
+                "faceFound": face_found,
+                "mode": "set",
+                "parameterValues": [{"id": parameter_id, "value": value} for parameter_id, value in values.items()]
+            },
+            reconnect=False,
+        )
+        record("vts_inject_parameters", start, in_trace=False)
+        return result
+
+    async def set_parameter_value(self, parameter_id: str, value: float):
+        '''Injects a single input parameter value.'''
+        return await self.set_parameter_values({parameter_id: value})
+
     async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
         if self.is_connected():
             await self.ws.close()
             print("🔌 Conexión WebSocket cerrada.")
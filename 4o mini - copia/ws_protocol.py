@@ -0,0 +1,102 @@
+'''
+Protocolo del chat por WebSocket (/api/chat/ws).
+
+Cliente -> servidor (mensajes de texto JSON):
+    {"type": "hello", "audio_credits": 8}      Opcional: activa el control de flujo por créditos.
+    {"type": "chat", "text": "...", "user_id": "...", "stream_audio": false}
+    {"type": "ack", "frames": 1}               Devuelve créditos de audio (solo con "hello").
+    {"type": "cancel"}                         Cancela el turno en curso.
+
+Servidor -> cliente:
+    Texto JSON para eventos de texto/control: {"type": "text", "turn": 1, "content": "..."},
+    "turn_start", "expression", "error", "done"...
+    Audio como frames binarios: cabecera de 8 bytes + MP3 crudo, sin base64.
+        kind     (uint8)  1 = audio de una oración completa, 2 = fragmento de audio
+        flags    (uint8)  bit 0 = último fragmento de la oración
+        turn     (uint32) número de turno dentro de la conexión
+        sentence (uint16) índice de la oración dentro del turno
+
+Backpressure: los mensajes salen por una cola acotada; si el cliente lee despacio, el turno
+(y con él la síntesis de voz) espera. Con "hello" además cada frame de audio consume un
+crédito y el servidor no envía audio sin créditos hasta que llegue un "ack".
+'''
+import os
+import json
+import asyncio
+import struct
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuración ---
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "32"))
+
+AUDIO_HEADER = struct.Struct("!BBIH")
+AUDIO_KIND_SENTENCE = 1
+AUDIO_KIND_CHUNK = 2
+AUDIO_FLAG_FINAL = 0x01
+
+def pack_audio_frame(event: dict, turn: int) -> bytes:
+    """Convierte un evento de audio ('audio' o 'audio_chunk') en un frame binario."""
+    kind = AUDIO_KIND_CHUNK if event["type"] == "audio_chunk" else AUDIO_KIND_SENTENCE
+    flags = AUDIO_FLAG_FINAL if event.get("final") else 0
+    header = AUDIO_HEADER.pack(kind, flags, turn, event.get("sentence", 0))
+    return header + event["data"]
+
+class ChatConnection:
+    """
+    Lado servidor de una conexión de chat: cola de salida acotada, tarea de envío
+    y créditos de audio opcionales.
+    """
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self._outgoing: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self._credits: asyncio.Semaphore | None = None
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def enable_credits(self, initial: int):
+        """Activa el control de flujo por créditos para los frames de audio."""
+        self._credits = asyncio.Semaphore(max(1, initial))
+
+    def add_credits(self, frames: int):
+        """El cliente confirma frames de audio ya consumidos."""
+        if self._credits is not None:
+            for _ in range(max(0, frames)):
+                self._credits.release()
+
+    async def _send_loop(self):
+        try:
+            while True:
+                message = await self._outgoing.get()
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Error al enviar por WebSocket: {e}")
+
+    async def send_json(self, message: dict):
+        """Encola un mensaje JSON compacto."""
+        await self._outgoing.put(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    def try_send_json(self, message: dict):
+        """Encola un mensaje JSON sin esperar; se descarta si la cola está llena."""
+        try:
+            self._outgoing.put_nowait(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+        except asyncio.QueueFull:
+            pass
+
+    async def send_event(self, turn: int, event: dict):
+        """Envía un evento del turno: el audio como frame binario, el resto como JSON."""
+        if "data" in event:
+            if self._credits is not None:
+                await self._credits.acquire()
+            await self._outgoing.put(pack_audio_frame(event, turn))
+        else:
+            await self.send_json({**event, "turn": turn})
+
+    def close(self):
+        self._sender.cancel()